@@ -1,14 +1,203 @@
+import os
+import tempfile
+
 from django.apps import AppConfig
 
 MODULE_NAME = 'membership'
 
 DEFAULT_CFG = {
+    "card_cache_backend": "disk",  # "disk", "django" or None to disable the card cache
+    "card_cache_dir": os.path.join(tempfile.gettempdir(), "membership_cards"),
+    "card_cache_alias": "default",  # django cache alias used by the "django" backend
+    "card_cache_max_bytes": 256 * 1024 * 1024,  # disk budget before LRU eviction kicks in
+    "card_cache_timeout": None,  # seconds, None keeps entries until evicted
+    "card_render_workers": 2,  # concurrent wkhtmltopdf processes per server process
+    "card_render_queue_size": 8,  # renders waiting for a worker before requests are rejected
+    "card_render_timeout": 60,  # seconds a single wkhtmltopdf run may take
+    "card_render_queue_timeout": 30,  # seconds a request waits for a worker
+    "card_render_retry_after": 5,  # Retry-After seconds returned when the queue is full
+    "card_render_metrics_perms": ["121701"],  # rights needed to read the render pool metrics, user administration
+    "card_lock_timeout": None,  # seconds a process waits for another one rendering the same card, None for render + queue timeouts
+    "card_lock_poll_interval": 0.2,  # seconds between card cache checks while another process renders
+    "card_job_workers": 1,  # background card jobs rendered concurrently per server process
+    "card_job_dir": os.path.join(tempfile.gettempdir(), "membership_card_jobs"),
+    "card_job_ttl": 3600,  # seconds a finished card can be downloaded
+    "card_job_max_per_user": 5,  # queued or running jobs a user may have, further submissions are refused
+    # images of the card templates: data URI, absolute path, static file name or http(s) URL
+    "card_assets": {
+        "logo": "https://release.openimis.org/front/static/media/openIMIS.f3351d9a.png",
+    },
+    "card_asset_fetch_remote": True,  # download remote card assets once per process and inline them
+    "card_asset_fetch_timeout": 5,  # seconds
+    "card_asset_retry_interval": 60,  # seconds a failed download is left remote before it is tried again
+    "card_remote_urls": "warn",  # remote URLs left in a card document: "warn", "error" or None to skip the check
+    "card_export_workers": 2,  # threads rendering the cards of one ZIP export
+    "card_export_perms": ["101101"],  # rights needed to export the cards of a location or health facility
+    "card_prerender_delay": None,  # seconds after the last change before stale cards are re-rendered, None disables it
+    "card_prerender_max_delay": 300,  # seconds after the first change a continuously edited family waits at most
+    "card_renderer": "wkhtmltopdf",  # "wkhtmltopdf", or "stub" for a blank PDF without starting a process
+    "card_stub_render_delay": 0,  # seconds the stub renderer pretends to work
+    # print-shop sheets: rows x cols cards per sheet, sizes in millimeters, cards designed for an A4 page
+    "card_imposition": {
+        "rows": 2,
+        "cols": 2,
+        "sheet_width": 210,
+        "sheet_height": 297,
+        "margin": 10,
+        "gutter": 6,
+        "card_width": 210,
+        "card_height": 297,
+        "crop_mark_length": 4,
+        "crop_mark_offset": 1,
+    },
+    "card_show_photo": False,  # print the insuree photo on the card, in place of the logo
+    "card_photo_dir": os.path.join(tempfile.gettempdir(), "membership_card_photos"),
+    "card_photo_size": [300, 400],  # pixels the photo thumbnails fit in, width x height
+    "card_photo_format": "JPEG",  # "JPEG" or "WEBP"
+    "card_photo_quality": 85,
+    "card_photo_workers": 2,  # processes scaling photos down per server process
+    "side_db_backend": "sqlite",  # "sqlite" for db.sqlite3, "orm" for the membership models in the main database
+    "side_db_write_behind": False,  # hand SQLite side database writes to a single writer thread committing them in batches
+    "side_db_write_batch_size": 100,  # writes committed per transaction at most
+    "side_db_write_timeout": 5,  # seconds a durable write waits for its commit
+    # PRAGMAs of every connection to the SQLite side database (db.sqlite3), None values are left to SQLite
+    "side_db_pragmas": {
+        "journal_mode": "wal",  # readers no longer block the writer
+        "synchronous": "normal",  # safe with WAL, syncs at checkpoints rather than at every commit
+        "busy_timeout": 5000,  # milliseconds a writer waits for the lock before "database is locked"
+        "cache_size": -16000,  # negative: KiB of page cache per connection
+        "mmap_size": 64 * 1024 * 1024,
+    },
+    "identity_cache_alias": "default",  # django cache shared by the processes resolving insuree users, None for local only
+    "identity_cache_timeout": 300,  # seconds a resolved insuree identity is kept in the django cache
+    "identity_local_cache_size": 10000,  # identities kept per process
+    "identity_local_cache_ttl": 30,  # seconds a process trusts its own copy, bounds staleness after changes elsewhere
+    "otp_store": "cache",  # "cache" keeps OTPs in otp_cache_alias, "database" on the registrations in the side database
+    "otp_cache_alias": "default",  # django cache of the OTPs, must be shared by the server processes
+    "otp_ttl": 300,  # seconds an OTP is valid
+    "otp_max_attempts": 5,  # checks of an OTP before it is dropped
+    "otp_pending_ttl": 86400,  # seconds after its OTP expired a registration never validated is deleted
+    "otp_sweep_interval": 3600,  # seconds between two sweeps of such registrations by a process, None disables it
+    "otp_transports": ["console"],  # "console" (logs the OTPs, development only), "file", "email" and/or "sms"
+    "otp_file_path": "otp_messages.jsonl",  # JSON lines the "file" transport appends the messages to
+    "otp_email_api_url": "https://send.api.mailtrap.io/api/send",  # email send API taking Mailtrap's payload
+    "otp_email_api_token": None,
+    "otp_email_sender": "hello@openimis.org",
+    "otp_sms_api_url": None,  # SMS gateway taking a JSON body of from, to and text
+    "otp_sms_api_token": None,
+    "otp_sms_sender": None,
+    "otp_delivery_workers": 2,  # threads delivering OTPs per server process
+    "otp_delivery_queue_size": 1000,  # OTPs waiting for delivery before registrations are refused
+    "otp_delivery_batch_size": 20,  # queued OTPs a thread hands to the transports at once
+    "otp_delivery_retries": 3,  # tries again of an OTP the provider failed
+    "otp_delivery_backoff": 1.0,  # seconds before the first try again, doubled at each, jittered
+    "otp_delivery_timeout": 10,  # seconds a provider request may take
+    "login_profile_cache_timeout": 0,  # seconds Signin's names and insuree info are cached in identity_cache_alias, 0 disables
+    "jwt_insuree_claims": False,  # sign the user's insuree into the tokens issued at sign in, read back instead of resolved
+    "card_template": None,  # card template name, None picks it from the operating system
+    "card_language": "en",  # language of the terms and conditions printed on the card
+}
+
+TERMS_AND_CONDITIONS = {
+    'en': [
+        "All citizens are required to register for a national identification card within 30 days of turning 18 years old.",
+        "Employers must verify the identification and legal work status of all employees before hiring.",
+        "All citizens must report any changes of address to the government within 10 days of moving.",
+        "Individuals must renew their identification cards every 5 years to ensure that the information remains current.",
+        "The government provides subsidies for low-income families to help cover the cost of obtaining identification cards."
+    ],
+    'es': [
+        "Todos los ciudadanos están obligados a registrarse para obtener una tarjeta de identificación nacional dentro de los 30 días posteriores a cumplir 18 años.",
+        "Los empleadores deben verificar la identificación y el estado legal de trabajo de todos los empleados antes de contratarlos.",
+        "Todos los ciudadanos deben informar cualquier cambio de dirección al gobierno dentro de los 10 días posteriores a la mudanza.",
+        "Las personas deben renovar sus tarjetas de identificación cada 5 años para asegurar que la información se mantenga actualizada.",
+        "El gobierno proporciona subsidios para familias de bajos ingresos para ayudar a cubrir el costo de obtener tarjetas de identificación."
+    ],
+    'fr': [
+        "Tous les citoyens sont tenus de s'inscrire pour une carte d'identité nationale dans les 30 jours suivant leur 18e anniversaire.",
+        "Les employeurs doivent vérifier l'identification et le statut légal de travail de tous les employés avant de les embaucher.",
+        "Tous les citoyens doivent signaler tout changement d'adresse au gouvernement dans les 10 jours suivant le déménagement.",
+        "Les individus doivent renouveler leurs cartes d'identité tous les 5 ans pour garantir que les informations restent à jour.",
+        "Le gouvernement offre des subventions aux familles à faible revenu pour aider à couvrir le coût de l'obtention des cartes d'identité."
+    ]
+    # Add more languages as needed
 }
 
+
 class MembershipCardConfig(AppConfig):
     name = MODULE_NAME
+    default_auto_field = "django.db.models.AutoField"
     gql_query_membership_generation_perms = None #todo
 
+    card_cache_backend = None
+    card_cache_dir = None
+    card_cache_alias = None
+    card_cache_max_bytes = None
+    card_cache_timeout = None
+    card_render_workers = 2
+    card_render_queue_size = 8
+    card_render_timeout = 60
+    card_render_queue_timeout = 30
+    card_render_retry_after = 5
+    card_render_metrics_perms = ["121701"]
+    card_lock_timeout = None
+    card_lock_poll_interval = 0.2
+    card_job_workers = 1
+    card_job_dir = None
+    card_job_ttl = 3600
+    card_job_max_per_user = 5
+    card_assets = {}
+    card_asset_fetch_remote = True
+    card_asset_fetch_timeout = 5
+    card_asset_retry_interval = 60
+    card_remote_urls = "warn"
+    card_export_workers = 2
+    card_export_perms = ["101101"]
+    card_prerender_delay = None
+    card_prerender_max_delay = 300
+    card_renderer = "wkhtmltopdf"
+    card_stub_render_delay = 0
+    card_imposition = {}
+    card_show_photo = False
+    card_photo_dir = None
+    card_photo_size = [300, 400]
+    card_photo_format = "JPEG"
+    card_photo_quality = 85
+    card_photo_workers = 2
+    side_db_backend = "sqlite"
+    side_db_pragmas = {}
+    side_db_write_behind = False
+    side_db_write_batch_size = 100
+    side_db_write_timeout = 5
+    identity_cache_alias = "default"
+    identity_cache_timeout = 300
+    identity_local_cache_size = 10000
+    identity_local_cache_ttl = 30
+    otp_store = "cache"
+    otp_cache_alias = "default"
+    otp_ttl = 300
+    otp_max_attempts = 5
+    otp_pending_ttl = 86400
+    otp_sweep_interval = 3600
+    otp_transports = ["console"]
+    otp_file_path = "otp_messages.jsonl"
+    otp_email_api_url = "https://send.api.mailtrap.io/api/send"
+    otp_email_api_token = None
+    otp_email_sender = "hello@openimis.org"
+    otp_sms_api_url = None
+    otp_sms_api_token = None
+    otp_sms_sender = None
+    otp_delivery_workers = 2
+    otp_delivery_queue_size = 1000
+    otp_delivery_batch_size = 20
+    otp_delivery_retries = 3
+    otp_delivery_backoff = 1.0
+    otp_delivery_timeout = 10
+    login_profile_cache_timeout = 0
+    jwt_insuree_claims = False
+    card_template = None
+    card_language = "en"
+
     membership_slip_name = f"membershi_card" #todo, head of family name ?
     wkhtml_cmd_options_for_printing = {
         # 'margin-top': 3,
@@ -24,6 +213,13 @@ class MembershipCardConfig(AppConfig):
     }
     @staticmethod
     def get_template_by_os():
+        """Card template name, resolved once in ready() from card_template or the operating system."""
+        if MembershipCardConfig.card_template is None:
+            MembershipCardConfig.card_template = MembershipCardConfig._template_for_os()
+        return MembershipCardConfig.card_template
+
+    @staticmethod
+    def _template_for_os():
         import platform
         system = platform.system()
         if system == "Windows":
@@ -38,30 +234,27 @@ class MembershipCardConfig(AppConfig):
         return template_name
 
     @staticmethod
-    def get_terms_and_conditions(language='en'):
-        conditions = {
-            'en': [
-                "All citizens are required to register for a national identification card within 30 days of turning 18 years old.",
-                "Employers must verify the identification and legal work status of all employees before hiring.",
-                "All citizens must report any changes of address to the government within 10 days of moving.",
-                "Individuals must renew their identification cards every 5 years to ensure that the information remains current.",
-                "The government provides subsidies for low-income families to help cover the cost of obtaining identification cards."
-            ],
-            'es': [
-                "Todos los ciudadanos están obligados a registrarse para obtener una tarjeta de identificación nacional dentro de los 30 días posteriores a cumplir 18 años.",
-                "Los empleadores deben verificar la identificación y el estado legal de trabajo de todos los empleados antes de contratarlos.",
-                "Todos los ciudadanos deben informar cualquier cambio de dirección al gobierno dentro de los 10 días posteriores a la mudanza.",
-                "Las personas deben renovar sus tarjetas de identificación cada 5 años para asegurar que la información se mantenga actualizada.",
-                "El gobierno proporciona subsidios para familias de bajos ingresos para ayudar a cubrir el costo de obtener tarjetas de identificación."
-            ],
-            'fr': [
-                "Tous les citoyens sont tenus de s'inscrire pour une carte d'identité nationale dans les 30 jours suivant leur 18e anniversaire.",
-                "Les employeurs doivent vérifier l'identification et le statut légal de travail de tous les employés avant de les embaucher.",
-                "Tous les citoyens doivent signaler tout changement d'adresse au gouvernement dans les 10 jours suivant le déménagement.",
-                "Les individus doivent renouveler leurs cartes d'identité tous les 5 ans pour garantir que les informations restent à jour.",
-                "Le gouvernement offre des subventions aux familles à faible revenu pour aider à couvrir le coût de l'obtention des cartes d'identité."
-            ]
-            # Add more languages as needed
-        }
-        return conditions.get(language, conditions['en'])
+    def get_terms_and_conditions(language=None):
+        language = language or MembershipCardConfig.card_language
+        return TERMS_AND_CONDITIONS.get(language, TERMS_AND_CONDITIONS['en'])
+
+    def __load_config(self, cfg):
+        for field in cfg:
+            if hasattr(MembershipCardConfig, field):
+                setattr(MembershipCardConfig, field, cfg[field])
 
+    def ready(self):
+        from core.models import ModuleConfiguration
+        cfg = ModuleConfiguration.get_or_default(MODULE_NAME, DEFAULT_CFG)
+        self.__load_config(cfg)
+        from membership.utils.card_assets import get_card_assets
+        get_card_assets()  # local card images are read once, remote ones start downloading, at startup
+        from membership.services import get_card_template
+        template_name = self.get_template_by_os()
+        if template_name:
+            get_card_template(template_name)
+        from membership.signals import connect_card_signals
+        connect_card_signals()
+        if self.side_db_backend == "sqlite":
+            from membership.utils.db_helper import get_sqlite_connections
+            get_sqlite_connections().ensure_schema()  # side tables are created once, not per SQLiteHelper
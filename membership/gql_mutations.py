@@ -1,6 +1,7 @@
 
 import graphene
 from .services import PDFGenerationService  
+from .utils.card_jobs import CardJobService, CardJobStatus
 class GeneratePdfSlip(graphene.Mutation):
     class Arguments:
         insuree_uuid = graphene.String(required=True)
@@ -15,3 +16,20 @@ class GeneratePdfSlip(graphene.Mutation):
         
         pdf_base64 = PDFGenerationService.generate_pdf(user, insuree_uuid, slip_type)
         return GeneratePdfSlip(base64_pdf=pdf_base64)
+
+
+class SubmitPdfSlipJob(graphene.Mutation):
+    """Queue the card rendering, poll `pdfSlipJob(jobId)` until its status is done."""
+    class Arguments:
+        insuree_uuid = graphene.String(required=True)
+
+    job_id = graphene.String()
+    status = graphene.String()
+
+    def mutate(self, info, insuree_uuid):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise Exception("You do not have permission to access this resource.")
+
+        job_id = CardJobService.submit(user, insuree_uuid)
+        return SubmitPdfSlipJob(job_id=job_id, status=CardJobStatus.QUEUED)
@@ -0,0 +1,23 @@
+import base64
+
+import graphene
+
+from .utils.card_jobs import CardJobService, CardJobStatus
+
+
+class PdfSlipJobGQLType(graphene.ObjectType):
+    job_id = graphene.String()
+    insuree_uuid = graphene.String()
+    status = graphene.String()
+    error = graphene.String()
+    base64_pdf = graphene.String()
+
+    def resolve_base64_pdf(parent, info):
+        # Only read the artifact when the client asks for it
+        if parent["status"] != CardJobStatus.DONE:
+            return None
+        try:
+            with open(CardJobService.artifact_path(parent["job_id"]), "rb") as pdf_file:
+                return base64.b64encode(pdf_file.read()).decode("utf-8")
+        except FileNotFoundError:  # purged since the status was read
+            return None
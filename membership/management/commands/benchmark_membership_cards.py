@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from membership.apps import MembershipCardConfig
+from membership.utils.card_benchmark import (
+    STAGES,
+    benchmark_batch,
+    benchmark_single,
+    create_synthetic_families,
+)
+from membership.utils.pdf_renderer import StubRenderer, WkhtmltopdfRenderer
+
+
+class Command(BaseCommand):
+    help = "Benchmark the membership card path on synthetic families: p50/p95 of the data loading, HTML " \
+           "and PDF stages and cards per second, one card per document and in batches. The synthetic " \
+           "data is rolled back unless --keep is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--families", type=int, default=20, help="Synthetic families to create (default 20)")
+        parser.add_argument("--members", type=int, default=5, help="Insurees per family, head included (default 5)")
+        parser.add_argument("--no-policies", action="store_true", help="Do not create a policy per family")
+        parser.add_argument("--iterations", type=int, default=1, help="Passes over all the cards (default 1)")
+        parser.add_argument("--batch-size", type=int, default=50, help="Cards per document in batch mode (default 50)")
+        parser.add_argument("--mode", choices=["single", "batch", "both"], default="both")
+        parser.add_argument("--stub", action="store_true", help="Replace wkhtmltopdf with the stub renderer")
+        parser.add_argument("--stub-delay", type=float, default=0, help="Seconds the stub renderer takes per document")
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic families in the database")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        if options["families"] < 1 or options["members"] < 1:
+            raise CommandError("--families and --members must be at least 1")
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise CommandError("Template for printing not available")
+        renderer = StubRenderer(options["stub_delay"]) if options["stub"] else WkhtmltopdfRenderer()
+
+        with transaction.atomic():
+            heads = create_synthetic_families(
+                options["families"], options["members"], policies=not options["no_policies"]
+            )
+            insurees = [member for head in heads for member in head.family.members.filter(validity_to=None)]
+            results = {}
+            if options["mode"] in ("single", "both"):
+                results["single"] = benchmark_single(
+                    insurees, renderer, template_name, options["iterations"]
+                ).summary()
+            if options["mode"] in ("batch", "both"):
+                results["batch"] = benchmark_batch(
+                    insurees, renderer, template_name, max(1, options["batch_size"]), options["iterations"]
+                ).summary()
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{len(insurees)} cards, {options['families']} families, "
+            f"{'stub' if options['stub'] else 'wkhtmltopdf'} renderer, {options['iterations']} iteration(s)"
+        )
+        for mode, summary in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{mode}: {summary['cards']} cards in {summary['elapsed']:.2f}s, "
+                f"{summary['cards_per_second']:.1f} cards/s"
+            ))
+            for stage in STAGES:
+                timing = summary["stages"][stage]
+                if not timing["count"]:
+                    continue
+                self.stdout.write(
+                    f"  {stage:<5} n={timing['count']:<5} p50={timing['p50'] * 1000:8.1f}ms "
+                    f"p95={timing['p95'] * 1000:8.1f}ms total={timing['total']:.2f}s"
+                )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from membership.utils.db_helper import CHECKPOINT_MODES, SQLiteHelper
+
+
+class Command(BaseCommand):
+    help = "Checkpoint the write-ahead log of the membership SQLite side database into the database file. " \
+           "SQLite checkpoints on its own as the log grows; run this from cron to keep the log short, e.g. " \
+           "with TRUNCATE during quiet hours, or before copying the database file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=[mode.lower() for mode in CHECKPOINT_MODES],
+            default="passive",
+            help="passive (default) never waits for readers or writers, full and restart wait for the writers, "
+                 "truncate also empties the log file",
+        )
+
+    def handle(self, *args, **options):
+        db_helper = SQLiteHelper()
+        try:
+            if db_helper.journal_mode() != "wal":
+                self.stdout.write("The side database is not in WAL mode, nothing to checkpoint")
+                return
+            busy, log_pages, checkpointed_pages = db_helper.checkpoint(options["mode"])
+        finally:
+            db_helper.close()
+        if busy:
+            self.stderr.write(f"Checkpoint blocked by a reader or writer, {checkpointed_pages} of {log_pages} "
+                              f"log pages copied")
+        else:
+            self.stdout.write(f"Checkpointed {checkpointed_pages} of {log_pages} log pages")
@@ -0,0 +1,90 @@
+import os
+import signal
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership.apps import MembershipCardConfig
+from membership.utils.card_export import (
+    ERRORS_ENTRY,
+    add_card_entry,
+    export_insurees,
+    iter_export_cards,
+    recover_zip,
+)
+
+
+class Command(BaseCommand):
+    help = "Export the membership cards of a location subtree or of a health facility as a ZIP of one PDF " \
+           "per insuree. Running it again on the same archive adds the missing cards only, so an " \
+           "interrupted export resumes where it stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the ZIP archive, appended to when it exists")
+        parser.add_argument("--location", dest="location_uuid", help="Location uuid, its whole subtree is exported")
+        parser.add_argument("--health-facility", dest="health_facility_uuid", help="Health facility uuid")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=f"Threads rendering cards (default card_export_workers, {MembershipCardConfig.card_export_workers})",
+        )
+        parser.add_argument("--chunk-size", type=int, default=100, help="Insurees loaded per query (default 100)")
+
+    def handle(self, *args, **options):
+        if bool(options["location_uuid"]) == bool(options["health_facility_uuid"]):
+            raise CommandError("One of --location or --health-facility is required")
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise CommandError("Template for printing not available")
+
+        output = options["output"]
+        if os.path.exists(output) and not zipfile.is_zipfile(output):
+            # Killed before the central directory was written, the complete entries are kept
+            recovered = recover_zip(output)
+            self.stdout.write(f"{output} was not closed properly, recovered {len(recovered)} entries")
+
+        # A scheduler stops the export with SIGTERM: finish the current entry and close the archive
+        self.terminated = False
+        previous_handler = signal.signal(signal.SIGTERM, self.terminate)
+        try:
+            self.export(output, template_name, options)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+    def terminate(self, signum, frame):
+        self.terminated = True
+
+    def export(self, output, template_name, options):
+        with zipfile.ZipFile(output, mode="a" if os.path.exists(output) else "w") as archive:
+            skip = set(archive.namelist()) - {ERRORS_ENTRY}
+            if skip:
+                self.stdout.write(f"{len(skip)} cards already in {output}, resuming")
+            insurees = export_insurees(options["location_uuid"], options["health_facility_uuid"])
+            cards = iter_export_cards(
+                None,
+                insurees,
+                template_name,
+                workers=options["workers"],
+                chunk_size=max(1, options["chunk_size"]),
+                skip=skip,
+            )
+            exported, failed = 0, 0
+            for entry_name, content, error in cards:
+                if self.terminated:
+                    break
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{entry_name}: {error}")
+                    continue
+                # Entries are written as they come, the archive is closed properly on interruption
+                add_card_entry(archive, entry_name, content)
+                exported += 1
+                if exported % 100 == 0:
+                    self.stdout.write(f"{exported} cards exported")
+
+        if self.terminated:
+            raise CommandError(f"Stopped after {exported} cards, run the command again to resume")
+        self.stdout.write(self.style.SUCCESS(f"Exported {exported} cards to {output}"))
+        if failed:
+            raise CommandError(f"{failed} cards failed, run the command again to retry them")
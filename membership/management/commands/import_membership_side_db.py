@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from membership.models import CardJob, FirebaseToken, MembershipInsuree, PaymentTransaction
+from membership.utils import db_helper
+
+
+def _timestamp(value):
+    """SQLite CURRENT_TIMESTAMP text, in UTC, or a date as datetime."""
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        day = parse_date(str(value))
+        if day is None:
+            return None
+        parsed = datetime.combine(day, time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def _json(value):
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# table, model, unique column the import skips existing rows on, row -> model fields
+TABLES = [
+    ("membership_insuree", MembershipInsuree, "phone", lambda row: {
+        "insuree_id": row["insuree_id"],
+        "phone": row["phone"],
+        "otp_code": row["otp_code"],
+        "user_id": row["user_id"],
+        "otp_expiry": row["otp_expiry"],
+        "otp_attempts": row["otp_attempts"] if "otp_attempts" in row.keys() else 0,
+        "created_at": _timestamp(row["created_at"]) or timezone.now(),
+    }),
+    ("payment_transactions", PaymentTransaction, "paypal_transaction_id", lambda row: {
+        "family_id": row["family_id"],
+        "paypal_transaction_id": row["paypal_transaction_id"],
+        "amount": row["amount"],
+        "status": row["status"],
+        "validity_to": _timestamp(row["validity_to"]),
+        "payment_json": _json(row["payment_json"]) if "payment_json" in row.keys() else None,
+        "created_at": _timestamp(row["created_at"]) or timezone.now(),
+    }),
+    ("firebase_tokens", FirebaseToken, "fcm_token", lambda row: {
+        "user_id": None if row["user_id"] is None else str(row["user_id"]),
+        "fcm_token": row["fcm_token"],
+        "created_at": _timestamp(row["created_at"]) or timezone.now(),
+    }),
+    ("card_jobs", CardJob, "id", lambda row: {
+        "id": row["id"],
+        "insuree_uuid": row["insuree_uuid"],
+        "user_id": row["user_id"],
+        "status": row["status"],
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "worker": row["worker"] if "worker" in row.keys() else None,
+    }),
+]
+
+
+class Command(BaseCommand):
+    help = "Copy the registrations, payments, FCM tokens and card jobs of the membership SQLite side database " \
+           "into the membership models of the main database, before switching side_db_backend to \"orm\". " \
+           "Rows already imported, by phone, PayPal transaction id, FCM token or job id, and rows without one " \
+           "are skipped, so the import can be run again to pick up rows written in the meantime."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=db_helper.DB_PATH, help=f"SQLite database (default {db_helper.DB_PATH})")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows inserted per query (default 500)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        source.row_factory = sqlite3.Row
+        try:
+            tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            with transaction.atomic():
+                for table, model, unique_field, to_fields in TABLES:
+                    if table not in tables:
+                        self.stdout.write(f"{table}: not in {path}, skipped")
+                        continue
+                    imported, skipped = self.import_table(source, table, model, unique_field, to_fields, options)
+                    self.stdout.write(f"{table}: {imported} rows imported, {skipped} skipped")
+        finally:
+            source.close()
+
+    def import_table(self, source, table, model, unique_field, to_fields, options):
+        batch_size = max(1, options["batch_size"])
+        imported, skipped = 0, 0
+        cursor = source.execute(f"SELECT * FROM {table} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return imported, skipped
+            instances = [model(**to_fields(row)) for row in rows]
+            existing = set(
+                model.objects.filter(
+                    **{f"{unique_field}__in": [getattr(instance, unique_field) for instance in instances]}
+                ).values_list(unique_field, flat=True)
+            )
+            new_instances = []
+            for instance in instances:
+                key = getattr(instance, unique_field)
+                # Rows without key could not be told apart from an earlier import
+                if key is None or key in existing:
+                    skipped += 1
+                    continue
+                existing.add(key)
+                new_instances.append(instance)
+            model.objects.bulk_create(new_instances, batch_size=batch_size)
+            imported += len(new_instances)
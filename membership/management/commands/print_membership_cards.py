@@ -0,0 +1,75 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+
+from membership.apps import MembershipCardConfig
+from membership.services import PDFGenerationService
+
+
+class Command(BaseCommand):
+    help = "Render the membership cards of a list of insurees, a family or a location subtree as the pages of " \
+           "one PDF per chunk, each chunk being a single wkhtmltopdf run. Intended for mass printing campaigns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the PDF to write, chunks get a _001, _002... suffix")
+        parser.add_argument("--insuree", dest="insuree_uuids", action="append", help="Insuree uuid, repeatable")
+        parser.add_argument("--family", dest="family_uuid", help="Family uuid")
+        parser.add_argument("--location", dest="location_uuid", help="Location uuid, its whole subtree is printed")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Maximum number of cards per document, bounds the memory used by wkhtmltopdf (default 500)",
+        )
+        parser.add_argument(
+            "--imposition",
+            metavar="ROWSxCOLS",
+            help="Impose the cards several per sheet with crop marks, e.g. 2x2 (default: one card per page)",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=0,
+            help="Seconds allowed for rendering one document, 0 (default) for no limit",
+        )
+
+    def handle(self, *args, **options):
+        if not (options["insuree_uuids"] or options["family_uuid"] or options["location_uuid"]):
+            raise CommandError("One of --insuree, --family or --location is required")
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise CommandError("Template for printing not available")
+
+        layout = None
+        if options["imposition"]:
+            try:
+                layout = PDFGenerationService.get_sheet_layout(options["imposition"])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        try:
+            insurees = list(PDFGenerationService.get_batch_insurees(
+                options["insuree_uuids"], options["family_uuid"], options["location_uuid"]
+            ))
+        except Http404:
+            raise CommandError(f"Location {options['location_uuid']} not found")
+        if not insurees:
+            raise CommandError("No insuree matches the selection")
+
+        chunk_size = max(1, options["chunk_size"])
+        chunks = [insurees[i:i + chunk_size] for i in range(0, len(insurees), chunk_size)]
+        base, ext = os.path.splitext(options["output"])
+        for index, chunk in enumerate(chunks, start=1):
+            output = options["output"] if len(chunks) == 1 else f"{base}_{index:03d}{ext or '.pdf'}"
+            pdf_content = PDFGenerationService.render_cards(
+                None,
+                PDFGenerationService.build_batch_contexts(chunk),
+                template_name,
+                timeout=options["timeout"],
+                layout=layout,
+            )
+            with open(output, "wb") as pdf_file:
+                pdf_file.write(pdf_content)
+            self.stdout.write(f"{output}: {len(chunk)} cards")
+        self.stdout.write(self.style.SUCCESS(f"Printed {len(insurees)} cards in {len(chunks)} document(s)"))
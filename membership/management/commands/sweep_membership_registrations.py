@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from membership.utils.otp_store import get_otp_store
+
+
+class Command(BaseCommand):
+    help = "Delete the insuree registrations whose OTP expired otp_pending_ttl seconds ago without being validated. " \
+           "Server processes sweep them every otp_sweep_interval seconds in the background; run this from cron " \
+           "when that is turned off."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Deleted {get_otp_store().sweep()} pending registrations")
@@ -0,0 +1,128 @@
+# Generated by Django 4.2 on 2026-10-18 16:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_missing_tables(apps, schema_editor):
+    existing_tables = schema_editor.connection.introspection.table_names()
+    for model_name in ("MembershipType", "Membership"):
+        model = apps.get_model("membership", model_name)
+        if model._meta.db_table not in existing_tables:
+            schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('insuree', '0002_family_familytype_photo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardJob',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('insuree_uuid', models.CharField(blank=True, max_length=36, null=True)),
+                ('user_id', models.CharField(blank=True, max_length=36, null=True)),
+                ('status', models.CharField(max_length=10)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.IntegerField(db_index=True, help_text='Unix timestamp of the submission')),
+                ('updated_at', models.IntegerField(help_text='Unix timestamp of the last status change')),
+            ],
+            options={
+                'db_table': 'membership_card_jobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='FirebaseToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(blank=True, db_index=True, max_length=36, null=True)),
+                ('fcm_token', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'membership_firebase_tokens',
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paypal_transaction_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('amount', models.FloatField(blank=True, null=True)),
+                ('status', models.CharField(blank=True, max_length=50, null=True)),
+                ('validity_to', models.DateTimeField(blank=True, null=True)),
+                ('payment_json', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('family', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='membership_payment_transactions', to='insuree.family')),
+            ],
+            options={
+                'db_table': 'membership_payment_transactions',
+            },
+        ),
+        migrations.CreateModel(
+            name='MembershipInsuree',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(blank=True, max_length=50, null=True, unique=True)),
+                ('otp_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('user_id', models.IntegerField(blank=True, db_index=True, help_text='Interactive user id (i_user_id) of the insuree', null=True)),
+                ('otp_expiry', models.IntegerField(blank=True, help_text='Unix timestamp of the OTP expiry', null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('insuree', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='membership_registrations', to='insuree.insuree')),
+            ],
+            options={
+                'db_table': 'membership_insuree',
+            },
+        ),
+        # Membership and MembershipType predate the migrations, their tables already exist on
+        # upgraded databases: they enter the state as is and are only created where missing
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='MembershipType',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('region', models.CharField(help_text='Name of the region', max_length=255)),
+                        ('area_type', models.CharField(choices=[('Rural', 'Rural'), ('Urban', 'Urban'), ('Mixed', 'Mixed')], help_text='Type of area: Rural, Urban, or Mixed', max_length=10)),
+                        ('levels_config', models.JSONField(help_text="For Rural/Urban, an integer for levels; for Mixed, a dict with 'urban' and 'rural' keys")),
+                        ('payments', models.JSONField(help_text='Array of payment amounts matching the levels')),
+                        ('is_paying', models.BooleanField(default=True, help_text='Whether this is a paying membership type (False for indigent)')),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                    ],
+                    options={
+                        'verbose_name': 'Membership Type',
+                        'verbose_name_plural': 'Membership Types',
+                        'unique_together': {('region', 'area_type', 'is_paying')},
+                    },
+                ),
+                migrations.CreateModel(
+                    name='Membership',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('member_name', models.CharField(help_text='Name of the member or family', max_length=255)),
+                        ('member_id', models.CharField(help_text='Unique identifier for the member', max_length=50, unique=True)),
+                        ('level', models.PositiveIntegerField(default=1, help_text='Membership level (1-based index)')),
+                        ('start_date', models.DateField(help_text='When the membership starts')),
+                        ('end_date', models.DateField(help_text='When the membership ends')),
+                        ('status', models.CharField(choices=[('active', 'Active'), ('expired', 'Expired'), ('suspended', 'Suspended')], default='active', help_text='Current status of the membership', max_length=20)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                        ('membership_type', models.ForeignKey(help_text='The type of this membership', on_delete=django.db.models.deletion.PROTECT, related_name='memberships', to='membership.membershiptype')),
+                    ],
+                    options={
+                        'verbose_name': 'Membership',
+                        'verbose_name_plural': 'Memberships',
+                        'ordering': ['-created_at'],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_tables, migrations.RunPython.noop),
+    ]
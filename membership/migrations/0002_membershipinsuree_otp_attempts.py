@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membershipinsuree',
+            name='otp_attempts',
+            field=models.IntegerField(default=0, help_text='Failed checks of the current OTP'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0002_membershipinsuree_otp_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardjob',
+            name='worker',
+            field=models.CharField(blank=True, help_text='<host>:<process id> of the server process running the job', max_length=300, null=True),
+        ),
+        migrations.AlterField(
+            model_name='cardjob',
+            name='status',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.db.models import JSONField
+from django.utils import timezone
 from enum import Enum
 import json
 
@@ -253,5 +254,77 @@ class Membership(models.Model):
         
         return membership_type, indigent_membership_type
 
+class MembershipInsuree(models.Model):
+    """
+    Insuree registration from the mobile app: the phone the OTP was sent to and,
+    once the OTP is validated, the interactive user created for the insuree.
+    """
+    insuree = models.ForeignKey(
+        "insuree.Insuree", models.DO_NOTHING, db_constraint=False, blank=True, null=True,
+        related_name="membership_registrations",
+    )
+    phone = models.CharField(max_length=50, unique=True, blank=True, null=True)
+    otp_code = models.CharField(max_length=10, blank=True, null=True)
+    user_id = models.IntegerField(
+        blank=True, null=True, db_index=True, help_text="Interactive user id (i_user_id) of the insuree"
+    )
+    otp_expiry = models.IntegerField(blank=True, null=True, help_text="Unix timestamp of the OTP expiry")
+    otp_attempts = models.IntegerField(default=0, help_text="Failed checks of the current OTP")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "membership_insuree"
+
+
+class PaymentTransaction(models.Model):
+    """
+    PayPal payment of a family.
+    """
+    family = models.ForeignKey(
+        "insuree.Family", models.DO_NOTHING, db_constraint=False, blank=True, null=True,
+        related_name="membership_payment_transactions",
+    )
+    paypal_transaction_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    amount = models.FloatField(blank=True, null=True)
+    status = models.CharField(max_length=50, blank=True, null=True)
+    validity_to = models.DateTimeField(blank=True, null=True)
+    payment_json = JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "membership_payment_transactions"
+
+
+class FirebaseToken(models.Model):
+    """
+    Firebase Cloud Messaging token of a mobile app installation.
+    """
+    user_id = models.CharField(max_length=36, blank=True, null=True, db_index=True)
+    fcm_token = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "membership_firebase_tokens"
+
+
+class CardJob(models.Model):
+    """
+    Membership card rendered in the background, see membership.utils.card_jobs.
+    """
+    id = models.CharField(max_length=64, primary_key=True)
+    insuree_uuid = models.CharField(max_length=36, blank=True, null=True)
+    user_id = models.CharField(max_length=36, blank=True, null=True)
+    status = models.CharField(max_length=10, db_index=True)
+    error = models.TextField(blank=True, null=True)
+    worker = models.CharField(
+        max_length=300, blank=True, null=True, help_text="<host>:<process id> of the server process running the job"
+    )
+    created_at = models.IntegerField(db_index=True, help_text="Unix timestamp of the submission")
+    updated_at = models.IntegerField(help_text="Unix timestamp of the last status change")
+
+    class Meta:
+        db_table = "membership_card_jobs"
+
+
 # class InsureeUsers(models.Model):
 #     user = 
\ No newline at end of file
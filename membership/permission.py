@@ -1,6 +1,7 @@
 from rest_framework.permissions import BasePermission
 from django.core.exceptions import ObjectDoesNotExist
-from membership.utils.db_helper import SQLiteHelper  # Specific class import to be clear
+from membership.apps import MembershipCardConfig
+from membership.utils.insuree_claims import request_insuree_identity
 
 class IsInsuree(BasePermission):
     """
@@ -8,18 +9,25 @@ class IsInsuree(BasePermission):
     """
 
     def has_permission(self, request, view):
-        # Step 1: Get the current user's i_user_id
-        user_id = request.user.i_user_id
+        # Step 1: Read the user's insuree from the token claims, or resolve its i_user_id, cached across requests
+        identity = request_insuree_identity(request)
 
-        # Step 2: Use SQLiteHelper to check if user is an insuree
-        db_helper = SQLiteHelper()
-        insuree_id = db_helper.get_insuree_id_by_user_id(user_id)
-        db_helper.close()
-
-        # Step 3: If insuree_id exists, the user is an insuree and has permission
-        return insuree_id is not None
+        # Step 2: If the user resolves to an insuree, the user has permission
+        return identity is not None
 
     def has_object_permission(self, request, view, obj):
         # Object-level permissions can be implemented here if needed
         # For example, you could check if the obj belongs to the user's insuree.
         return True
+
+
+class HasMembershipPerms(BasePermission):
+    """
+    Allow users holding the rights of the MembershipCardConfig setting named by the view's
+    `perms_setting`, read at request time as the module configuration is loaded at startup.
+    """
+
+    def has_permission(self, request, view):
+        perms = getattr(MembershipCardConfig, view.perms_setting)
+        # No rights configured is no access, has_perms would let everyone in
+        return bool(request.user and request.user.is_authenticated and perms and request.user.has_perms(perms))
@@ -0,0 +1,24 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class PDFRenderer(BaseRenderer):
+    """
+    Lets clients ask for raw card PDFs (`Accept: application/pdf` or `?format=pdf`).
+    The PDF itself is streamed by the view, only error payloads go through render().
+    """
+    media_type = "application/pdf"
+    format = "pdf"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        renderer_context["response"]["Content-Type"] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class Base64Renderer(PDFRenderer):
+    """Chunked base64 text (`?format=base64`) for clients that cannot handle binary bodies."""
+    media_type = "text/plain"
+    format = "base64"
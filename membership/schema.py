@@ -2,11 +2,20 @@
 import graphene
 
 
-from .gql_mutations import GeneratePdfSlip
+from .gql_mutations import GeneratePdfSlip, SubmitPdfSlipJob
+from .gql_queries import PdfSlipJobGQLType
+from .utils.card_jobs import CardJobService
 
 class Query(graphene.ObjectType):
-    pass
+    pdf_slip_job = graphene.Field(PdfSlipJobGQLType, job_id=graphene.String(required=True))
+
+    def resolve_pdf_slip_job(self, info, job_id):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise Exception("You do not have permission to access this resource.")
+        return CardJobService.get_job(job_id, user)
 
 
 class Mutation(graphene.ObjectType):
     generate_pdf_slip = GeneratePdfSlip.Field()
+    submit_pdf_slip_job = SubmitPdfSlipJob.Field()
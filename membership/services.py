@@ -1,10 +1,25 @@
 from insuree.models import Insuree, Family, InsureePolicy
-from membership.apps import MembershipCardConfig
+from membership.apps import DEFAULT_CFG, MembershipCardConfig
+from membership.utils.card_assets import check_remote_urls, get_card_assets
+from membership.utils.card_cache import compute_fingerprint, get_card_cache
+from membership.utils.eligibility import EligibilityCalendar, is_month_covered
+from membership.utils.imposition import SheetLayout, card_partials, parse_grid
+from membership.utils.pdf_renderer import get_pdf_renderer
+from membership.utils.photo_thumbnails import get_photo_thumbnails
+from membership.utils.render_pool import get_render_executor
+from membership.utils.single_flight import render_once
 import base64
-from wkhtmltopdf.views import PDFTemplateResponse
+import hashlib
+import io
+import os
+from collections import namedtuple
+from functools import lru_cache, partial
+from pathlib import Path
+from wkhtmltopdf.utils import render_to_temporary_file
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
 from django.http import HttpRequest
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 import calendar
 from datetime import datetime, timedelta
@@ -29,101 +44,379 @@ import base64
 from django.core.files.base import ContentFile
 
 
+class CardPdf(namedtuple("CardPdf", ["fingerprint", "file"])):
+    """A rendered card: the fingerprint of its inputs and a binary file object to read it from."""
+
+    def size(self):
+        if hasattr(self.file, "fileno"):
+            return os.fstat(self.file.fileno()).st_size
+        return len(self.file.getbuffer())
+
+
+CardData = namedtuple("CardData", ["insuree", "members", "policies"])
+
+
+def card_members():
+    """Current family member rows, with what the members table of the card reads."""
+    return Insuree.objects.filter(validity_to=None).select_related("gender", "health_facility").order_by("id")
+
+
 class PDFGenerationService:
     @staticmethod
     def generate_pdf(user, insuree_uuid, slip_type=None):
-        insuree = Insuree.objects.filter(uuid=insuree_uuid, validity_to=None)
-        insuree_families = (
-            Insuree.objects.filter(family=insuree.first().family).order_by("id").all()
+        pdf_content = PDFGenerationService.generate_pdf_bytes(user, insuree_uuid, slip_type)
+        pdf_base64 = base64.b64encode(pdf_content).decode("utf-8")
+        return pdf_base64
+
+    @staticmethod
+    def generate_pdf_bytes(user, insuree_uuid, slip_type=None):
+        card = PDFGenerationService.generate_card(user, insuree_uuid, slip_type)
+        with card.file:
+            return card.file.read()
+
+    @staticmethod
+    def generate_card(user, insuree_uuid, slip_type=None, etag=None):
+        """
+        Return the card as a CardPdf whose file can be streamed as is. When `etag` matches
+        the card fingerprint the client copy is current: nothing is rendered and file is None.
+        """
+        card_data = PDFGenerationService.load_card_data(insuree_uuid)
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise Exception("Template for printing not available")
+        return PDFGenerationService.render_card(user, card_data, template_name, etag)
+
+    @staticmethod
+    def render_card(user, card_data, template_name, etag=None):
+        """Render a loaded card (see load_card_data) through the card cache, as a CardPdf."""
+        fingerprint = PDFGenerationService.card_fingerprint(
+            card_data.insuree, card_data.members, card_data.policies, template_name
+        )
+        if etag == fingerprint:
+            return CardPdf(fingerprint, None)
+        # Serve repeat downloads from the card cache, the key changes whenever an input of the card does
+        card_cache = get_card_cache()
+        if card_cache:
+            pdf_file = card_cache.open(fingerprint)
+            if pdf_file is not None:
+                return CardPdf(fingerprint, pdf_file)
+
+        # Concurrent requests for the same card share one render, see render_once
+        pdf_content = render_once(
+            fingerprint,
+            partial(
+                PDFGenerationService.render_cards,
+                user,
+                [PDFGenerationService.build_card_context(*card_data)],
+                template_name,
+            ),
+            card_cache,
+        )
+        return CardPdf(fingerprint, io.BytesIO(pdf_content))
+
+    @staticmethod
+    def generate_batch_pdf(user, insuree_uuids=None, family_uuid=None, location_uuid=None):
+        """
+        Render the cards of several insurees as the pages of one document, in a single
+        wkhtmltopdf run. Insurees are selected by uuid, by family or by location subtree.
+        """
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise Exception("Template for printing not available")
+        insurees = list(
+            PDFGenerationService.get_batch_insurees(insuree_uuids, family_uuid, location_uuid)
         )
-        if not insuree:
+        if not insurees:
             raise Exception("Insuree not found.")
-        chfid = str(insuree.first().chf_id)
-        chfid_array = list(chfid)
-        photo = PDFGenerationService.get_insuree_photo(insuree.first())
-        current_year_html = PDFGenerationService.generate_eligibility_html(
-            insuree, datetime.now().year
+        return PDFGenerationService.render_cards(
+            user, PDFGenerationService.build_batch_contexts(insurees), template_name
         )
-        next_year_html = PDFGenerationService.generate_eligibility_html(
-            insuree, datetime.now().year + 1
+
+    @staticmethod
+    def load_card_data(insuree_uuid):
+        """
+        Everything a card reads from the database, in three queries: the insuree with its
+        family, gender, health facility and photo, the family members with their gender and
+        health facility, and the insuree policies. The template then renders without queries.
+        """
+        insuree = (
+            Insuree.objects.filter(uuid=insuree_uuid, validity_to=None)
+            .select_related("family", "gender", "health_facility", "photo")
+            .first()
         )
+        if insuree is None:
+            raise Exception("Insuree not found.")
+        if insuree.family_id:
+            members = list(card_members().filter(family_id=insuree.family_id))
+        else:
+            members = [insuree]
+        policies = list(InsureePolicy.objects.filter(insuree=insuree))
+        return CardData(insuree, members, policies)
 
-        context = {
+    @staticmethod
+    def get_batch_insurees(insuree_uuids=None, family_uuid=None, location_uuid=None, health_facility_uuid=None):
+        insurees = Insuree.objects.filter(validity_to=None)
+        if insuree_uuids:
+            insurees = insurees.filter(uuid__in=insuree_uuids)
+        elif family_uuid:
+            insurees = insurees.filter(family__uuid=family_uuid, family__validity_to=None)
+        elif location_uuid:
+            location = get_object_or_404(
+                location_models.Location, uuid=location_uuid, validity_to=None
+            )
+            insurees = insurees.filter(
+                family__location_id__in=get_location_subtree_ids(location),
+                family__validity_to=None,
+            )
+        elif health_facility_uuid:
+            insurees = insurees.filter(
+                health_facility__uuid=health_facility_uuid, health_facility__validity_to=None
+            )
+        else:
+            raise ValueError("insuree_uuids, family_uuid, location_uuid or health_facility_uuid is required")
+        return insurees.select_related("family", "gender", "health_facility", "photo").order_by(
+            "family_id", "-head", "id"
+        )
+
+    @staticmethod
+    def load_batch_card_data(insurees):
+        """
+        CardData of each insuree, in two queries whatever their number: one for the members
+        of all families and one for all policies.
+        """
+        members_by_family = {}
+        family_ids = {insuree.family_id for insuree in insurees if insuree.family_id}
+        for member in card_members().filter(family_id__in=family_ids):
+            members_by_family.setdefault(member.family_id, []).append(member)
+        policies_by_insuree = {}
+        for insuree_policy in InsureePolicy.objects.filter(insuree__in=insurees):
+            policies_by_insuree.setdefault(insuree_policy.insuree_id, []).append(insuree_policy)
+        return [
+            CardData(
+                insuree,
+                members_by_family.get(insuree.family_id, [insuree]),
+                policies_by_insuree.get(insuree.id, []),
+            )
+            for insuree in insurees
+        ]
+
+    @staticmethod
+    def build_batch_contexts(insurees):
+        return [
+            PDFGenerationService.build_card_context(*card_data)
+            for card_data in PDFGenerationService.load_batch_card_data(insurees)
+        ]
+
+    @staticmethod
+    def build_card_context(insuree, insuree_families, insuree_policies=None):
+        """Context of a single card page, see the `cards` loop of the card templates."""
+        if insuree_policies is None:
+            insuree_policies = InsureePolicy.objects.filter(insuree=insuree)
+        # Policies are merged once, both years are read from the same calendar
+        current_year = datetime.now().year
+        masks = EligibilityCalendar(insuree_policies).masks([current_year, current_year + 1])
+        return {
             "insurees": insuree_families,
-            "insuree": insuree.first(),
-            "chfid_array": chfid_array,
-            "multiple": False,  # Multiple Card
-            "title": f"{insuree.first().last_name} {insuree.first().other_names}",
-            "current_year_html": current_year_html,  # Adding the current year HTML to the context
-            "next_year_html": next_year_html,  # Adding the next year HTML to the context
-            "conditions": MembershipCardConfig.get_terms_and_conditions,
+            "insuree": insuree,
+            "chfid_array": list(str(insuree.chf_id)),
+            "photo": PDFGenerationService.card_photo_uri(insuree),
+            "eligibility_masks": masks,
+            "current_year_html": PDFGenerationService.eligibility_html_from_mask(
+                current_year, masks[current_year]
+            ),
+            "next_year_html": PDFGenerationService.eligibility_html_from_mask(
+                current_year + 1, masks[current_year + 1]
+            ),
         }
+
+    @staticmethod
+    def render_cards(user, cards, template_name, timeout=None, layout=None):
+        """
+        Render the card pages to PDF on the render pool. `timeout` defaults to
+        card_render_timeout, 0 lets the renderer run as long as it needs.
+        With a SheetLayout the cards are imposed several per sheet instead of one per page.
+        """
+        if timeout is None:
+            timeout = MembershipCardConfig.card_render_timeout
+        html_file = PDFGenerationService.render_cards_html(user, cards, template_name, layout)
+        # The pool closes, and so deletes, the HTML file once the renderer is done with it
+        return get_render_executor().run(
+            partial(
+                get_pdf_renderer().render,
+                html_file.name,
+                PDFGenerationService.cmd_options(layout),
+                timeout=timeout or None,
+            ),
+            timeout=timeout or None,
+            cleanup=html_file.close,
+        )
+
+    @staticmethod
+    def render_cards_html(user, cards, template_name, layout=None):
+        """Render the card pages to a temporary HTML file, deleted once closed."""
+        context = {
+            "cards": cards,
+            "multiple": len(cards) > 1,  # Multiple Card
+            "title": f"{cards[0]['insuree'].last_name} {cards[0]['insuree'].other_names}",
+            "conditions": MembershipCardConfig.get_terms_and_conditions(),
+            "conditions_html": card_conditions_html(MembershipCardConfig.card_language),
+            "assets": get_card_assets(),
+        }
+        if layout is not None:
+            # The sheet places the page of the card template in each cell of its grid
+            styles_template, page_template = card_partials(template_name)
+            context.update(layout.context(cards), styles_template=styles_template, page_template=page_template)
+            template_name = "card_sheet.html"
         # Prepare an HttpRequest object
         request = HttpRequest()
         request.user = user
-        # Create a PDF response
-        if not MembershipCardConfig.get_template_by_os():
-            raise Exception("Template for printing not available")
-        response = PDFTemplateResponse(
-            request=request,
-            template=MembershipCardConfig.get_template_by_os(),
+        html_file = render_to_temporary_file(
+            template=get_card_template(template_name),
             context=context,
-            cmd_options=MembershipCardConfig.wkhtml_cmd_options_for_printing,
-            filename=MembershipCardConfig.membership_slip_name,
+            request=request,
+            prefix="wkhtmltopdf",
+            suffix=".html",
+        )
+        if MembershipCardConfig.card_remote_urls:
+            try:
+                html_file.seek(0)
+                check_remote_urls(html_file.read().decode("utf-8"))
+            except Exception:
+                html_file.close()
+                raise
+        return html_file
+
+    @staticmethod
+    def cmd_options(layout=None):
+        options = dict(MembershipCardConfig.wkhtml_cmd_options_for_printing)
+        if layout is not None:
+            # Sheets are laid out in millimeters, the page must match them exactly
+            options.pop("page-size", None)
+            options.update({
+                "page-width": f"{layout.sheet_width}mm",
+                "page-height": f"{layout.sheet_height}mm",
+                "orientation": "Portrait",
+                "margin-top": "0",
+                "margin-bottom": "0",
+                "margin-left": "0",
+                "margin-right": "0",
+                "disable-smart-shrinking": True,
+            })
+        return options
+
+    @staticmethod
+    def get_sheet_layout(grid=None):
+        """SheetLayout of card_imposition, `grid` ("rows x cols") overriding its grid."""
+        rows, cols = parse_grid(grid) if grid else (None, None)
+        # A partial card_imposition in the module configuration only overrides the keys it sets
+        config = {**DEFAULT_CFG["card_imposition"], **MembershipCardConfig.card_imposition}
+        return SheetLayout.from_config(config, rows, cols)
+
+    @staticmethod
+    def generate_imposed_pdf(user, grid=None, insuree_uuid=None, **selection):
+        """
+        Print-ready sheets of several cards each, with crop marks, in a single renderer run.
+        `insuree_uuid` selects the insuree's family, other selections are those of get_batch_insurees.
+        """
+        template_name = MembershipCardConfig.get_template_by_os()
+        if not template_name:
+            raise Exception("Template for printing not available")
+        layout = PDFGenerationService.get_sheet_layout(grid)
+        if insuree_uuid:
+            family_uuid = (
+                Family.objects.filter(members__uuid=insuree_uuid, validity_to=None)
+                .values_list("uuid", flat=True)
+                .first()
+            )
+            selection = {"family_uuid": family_uuid} if family_uuid else {"insuree_uuids": [insuree_uuid]}
+        insurees = list(PDFGenerationService.get_batch_insurees(**selection))
+        if not insurees:
+            raise Exception("Insuree not found.")
+        return PDFGenerationService.render_cards(
+            user, PDFGenerationService.build_batch_contexts(insurees), template_name, layout=layout
         )
-        response.render()
-        pdf_content = response.content
-        pdf_base64 = base64.b64encode(pdf_content).decode("utf-8")
-        return pdf_base64
+
+    @staticmethod
+    def card_fingerprint(insuree, members, insuree_policies, template_name):
+        """
+        Fingerprint of everything that ends up on a card: the insuree and family rows, the
+        gender and health facility names printed for them, the policy validity windows, the
+        template source, the card language and the wkhtmltopdf options.
+        Open-ended policies are covered up to today, hence the current month is part of it.
+        """
+        def row(instance):
+            if instance is None:
+                return None
+            return [(f.attname, getattr(instance, f.attname)) for f in instance._meta.concrete_fields]
+
+        def names(member):
+            health_facility = member.health_facility
+            return [
+                row(member.gender),
+                [health_facility.code, health_facility.name] if health_facility else None,
+            ]
+
+        today = datetime.now().date()
+        return compute_fingerprint(
+            row(insuree),
+            names(insuree),
+            row(insuree.family),
+            [row(member) for member in members],
+            [names(member) for member in members],
+            [(p.id, p.validity_from, p.validity_to) for p in insuree_policies],
+            template_name,
+            card_template_digest(template_name),
+            MembershipCardConfig.card_language,
+            MembershipCardConfig.wkhtml_cmd_options_for_printing,
+            MembershipCardConfig.card_assets,
+            MembershipCardConfig.card_show_photo,
+            [today.year, today.month],
+        )
+
+    @staticmethod
+    def card_photo_uri(insuree):
+        # Only the current photo: looking up older ones would cost a query per card
+        if not MembershipCardConfig.card_show_photo or not insuree.photo_id:
+            return None
+        photo_path = PDFGenerationService.get_insuree_photo(insuree)
+        return Path(photo_path).as_uri() if photo_path else None
 
     @staticmethod
     def get_insuree_photo(insuree):
-        if insuree and insuree.photos.exists():
-            insuree_photo = insuree.photos.first()
-            return insuree_photo.full_file_path()
+        """Path of a card-sized thumbnail of the insuree's current photo, None without photo."""
+        if insuree is None:
+            return None
+        # The current photo is loaded along with the insuree, photos only holds older ones
+        insuree_photo = insuree.photo if insuree.photo_id else insuree.photos.first()
+        if insuree_photo:
+            return get_photo_thumbnails().path(insuree_photo)
         return None
 
     @staticmethod
-    def generate_eligibility_html(insuree, year):
-        # import pdb;pdb.set_trace();
-        insuree_policies = InsureePolicy.objects.filter(insuree=insuree.first())
-
-        month_names = [calendar.month_name[i] for i in range(1, 13)]
-        month_divs = {
-            month: '<div style="border: solid 1px rgb(1, 1, 1); width: 100px;height: 100px; border-radius: 50%;"></div>'
-            for month in month_names
-        }
+    def generate_eligibility_html(insuree, year, insuree_policies=None):
+        if insuree_policies is None:
+            insuree_policies = InsureePolicy.objects.filter(insuree=insuree)
+        mask = EligibilityCalendar(insuree_policies).month_mask(year)
+        return PDFGenerationService.eligibility_html_from_mask(year, mask)
 
-        for policy in insuree_policies:
-            start_date = (
-                policy.validity_from.date()
-                if isinstance(policy.validity_from, datetime)
-                else policy.validity_from
-            )
-            end_date = (
-                policy.validity_to.date()
-                if policy.validity_to
-                else datetime.now().date()
-            )
-            end_date = (
-                end_date
-                if isinstance(end_date, datetime)
-                else datetime.combine(end_date, datetime.min.time())
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def eligibility_html_from_mask(year, mask):
+        """
+        Eligibility table of a year, a stamped circle for each month set in the 12-bit mask.
+        Memoised, a year has at most 4096 different tables and most cards share a handful of them.
+        """
+        # The stamp image is set once per document by the eligibility-stamp class of the card templates
+        month_divs_list = [
+            (
+                '<div class="eligibility-stamp" style="border: solid 1px rgb(1, 1, 1); width: 100px;height: 100px; border-radius: 50%; opacity: 0.3; background-size: cover;"></div>'
+                if is_month_covered(mask, month)
+                else '<div style="border: solid 1px rgb(1, 1, 1); width: 100px;height: 100px; border-radius: 50%;"></div>'
             )
-
-            while start_date <= end_date.date():
-                if start_date.year == year:
-                    month_name = calendar.month_name[start_date.month]
-                    month_divs[month_name] = (
-                        f"<div style=\"border: solid 1px rgb(1, 1, 1); width: 100px;height: 100px; border-radius: 50%; opacity: 0.3; background-image: url('https://release.openimis.org/front/static/media/openIMIS.f3351d9a.png'); background-size: cover;\"></div>"
-                    )
-                start_date = (start_date.replace(day=28) + timedelta(days=4)).replace(
-                    day=1
-                )
+            for month in range(1, 13)
+        ]
 
         eligibility_html = f'<table style="width: 100%;" border="1"><thead><tr><th colspan="3">{year}</th></tr></thead><tbody>'
-        month_divs_list = list(month_divs.values())
-
         for i in range(0, len(month_divs_list), 3):
             eligibility_html += "<tr>"
             for j in range(3):
@@ -137,6 +430,41 @@ class PDFGenerationService:
         return eligibility_html
 
 
+def get_location_subtree_ids(location):
+    """Ids of the location and of all its descendants, one query per hierarchy level."""
+    location_ids = [location.id]
+    parent_ids = [location.id]
+    while parent_ids:
+        parent_ids = list(
+            location_models.Location.objects.filter(
+                parent_id__in=parent_ids, validity_to=None
+            ).values_list("id", flat=True)
+        )
+        location_ids.extend(parent_ids)
+    return location_ids
+
+
+@lru_cache(maxsize=None)
+def get_card_template(template_name):
+    """Compiled card template, loaded once per process (warmed up in MembershipCardConfig.ready)."""
+    return get_template(template_name)
+
+
+@lru_cache(maxsize=None)
+def card_template_digest(template_name):
+    """sha256 of the source of the card template, which is compiled once per process as well."""
+    with open(get_card_template(template_name).origin.name, "rb") as template_file:
+        return hashlib.sha256(template_file.read()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def card_conditions_html(language):
+    """Terms and conditions list of the card, rendered once per language."""
+    return mark_safe(generate_conditions_html(
+        escape(condition) for condition in MembershipCardConfig.get_terms_and_conditions(language)
+    ))
+
+
 def generate_conditions_html(conditions):
     conditions_html = '<ol type="1">'
     for condition in conditions:
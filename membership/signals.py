@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from membership.apps import MembershipCardConfig
+from membership.utils.card_prerender import get_card_prerender_queue
+from membership.utils.photo_thumbnails import get_photo_thumbnails
+
+
+def schedule_family_cards(family_id):
+    """Queue the cards of a family for pre-rendering once the current transaction commits."""
+    queue = get_card_prerender_queue()
+    if queue is None or not family_id:
+        return
+    transaction.on_commit(lambda: queue.schedule(family_id))
+
+
+def schedule_insuree_family_cards(insuree_id):
+    queue = get_card_prerender_queue()
+    if queue is None or not insuree_id:
+        return
+
+    def schedule():
+        from insuree.models import Insuree
+        queue.schedule(Insuree.objects.filter(id=insuree_id).values_list("family_id", flat=True).first())
+
+    transaction.on_commit(schedule)
+
+
+# Each card lists the whole family, so any change re-renders the cards of all its members.
+# The old cards need no invalidation: their cache key is a fingerprint of the changed rows.
+
+def on_insuree_change(sender, instance, **kwargs):
+    schedule_family_cards(instance.family_id)
+
+
+def on_family_change(sender, instance, **kwargs):
+    schedule_family_cards(instance.id)
+
+
+def on_insuree_policy_change(sender, instance, **kwargs):
+    schedule_insuree_family_cards(instance.insuree_id)
+
+
+def on_insuree_photo_change(sender, instance, **kwargs):
+    schedule_insuree_family_cards(instance.insuree_id)
+    if kwargs.get("created") and MembershipCardConfig.card_show_photo:
+        # Scaled down at upload time, the first card render finds the thumbnail ready
+        transaction.on_commit(lambda: get_photo_thumbnails().prefetch(instance))
+
+
+def connect_card_signals():
+    from insuree.models import Family, Insuree, InsureePhoto, InsureePolicy
+
+    for model, receiver in (
+        (Insuree, on_insuree_change),
+        (Family, on_family_change),
+        (InsureePolicy, on_insuree_policy_change),
+        (InsureePhoto, on_insuree_photo_change),
+    ):
+        post_save.connect(receiver, sender=model, dispatch_uid=f"membership_card_{model.__name__}_post_save")
+        post_delete.connect(receiver, sender=model, dispatch_uid=f"membership_card_{model.__name__}_post_delete")
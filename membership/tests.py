@@ -1,10 +1,41 @@
 import base64
+import io
 import json
-from django.test import TestCase, Client
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, datetime
+from types import SimpleNamespace
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client
 from graphene.test import Client as GrapheneClient
-from insuree.models import Insuree, Family
+from insuree.models import Gender, Insuree, Family
+from insuree.test_helpers import create_test_insuree
 from core.schema import schema  # Import the schema from your schema.py file
-from .models import MembershipType, AreaType
+from .apps import MembershipCardConfig
+from .services import PDFGenerationService, card_conditions_html, get_card_template
+from .models import MembershipInsuree, MembershipType, AreaType
+from .utils.card_assets import CardAssets, find_remote_urls, resolve_asset
+from .utils.card_cache import DiskCardCache, compute_fingerprint
+from .utils.card_benchmark import StageTimer
+from .utils.card_export import add_card_entry, recover_zip, stream_card_zip
+from .utils.card_jobs import CardJobLimitReached, CardJobService, CardJobStatus
+from .utils.card_prerender import CardPrerenderQueue
+from .utils.db_helper import MIGRATIONS, SQLiteConnections, SQLiteWriter, create_tables, migrate, schema_version
+from .utils.orm_helper import ORMHelper
+from .utils.eligibility import EligibilityCalendar, merge_intervals
+from .utils.identity import IdentityResolver, InsureeIdentity, get_identity_resolver
+from .utils.insuree_claims import request_insuree_identity
+from .utils.login_profile import load_login_profile
+from .utils.otp_delivery import FileTransport, OTPDelivery, OTPMessage, OTPTransport
+from .utils.otp_store import CacheOTPStore, DatabaseOTPStore, OTPCheck
+from .utils.imposition import SheetLayout, parse_grid
+from .utils.pdf_renderer import StubRenderer
+from .utils.photo_thumbnails import Image, PhotoThumbnails
+from .utils.render_pool import RenderExecutor, RenderQueueFull, RenderTimeout
+from .utils.single_flight import SingleFlight, render_once
 
 class GeneratePdfSlipTestCase(TestCase):
     def setUp(self):
@@ -60,6 +91,885 @@ class GeneratePdfSlipTestCase(TestCase):
 
 
 
+class DiskCardCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_fingerprint_is_stable(self):
+        self.assertEqual(compute_fingerprint({"a": 1, "b": 2}, "x"), compute_fingerprint({"b": 2, "a": 1}, "x"))
+        self.assertNotEqual(compute_fingerprint("x"), compute_fingerprint("y"))
+
+    def test_least_recently_used_card_is_evicted(self):
+        card_cache = DiskCardCache(self.tmp_dir.name, max_bytes=250)
+        card_cache.set("first", b"1" * 100)
+        card_cache.set("second", b"2" * 100)
+        # Touch the first card so the second one becomes the least recently used
+        past = time.time() - 60
+        os.utime(card_cache.path("second"), (past, past))
+        self.assertEqual(card_cache.get("first"), b"1" * 100)
+        card_cache.set("third", b"3" * 100)
+
+        self.assertIsNone(card_cache.get("second"))
+        self.assertEqual(card_cache.get("first"), b"1" * 100)
+        self.assertEqual(card_cache.get("third"), b"3" * 100)
+
+
+class RenderExecutorTestCase(SimpleTestCase):
+    def test_full_queue_rejects_immediately(self):
+        executor = RenderExecutor(max_workers=1, max_queue=1, retry_after=7)
+        release = threading.Event()
+        running = executor.submit(release.wait)
+        queued = executor.submit(lambda: "queued")
+        with self.assertRaises(RenderQueueFull) as raised:
+            executor.submit(lambda: "rejected")
+        self.assertEqual(raised.exception.retry_after, 7)
+        self.assertEqual(executor.metrics()["rejected"], 1)
+
+        release.set()
+        self.assertTrue(running.result(timeout=5))
+        self.assertEqual(queued.result(timeout=5), "queued")
+        self.assertEqual(executor.run(lambda: "after", timeout=5), "after")
+        metrics = executor.metrics()
+        self.assertEqual(metrics["completed"], 3)
+        self.assertEqual(metrics["queue_depth"], 0)
+
+    def test_timeouts_counted_once_and_cleaned_up_after_the_job(self):
+        executor = RenderExecutor(max_workers=1, max_queue=2, queue_timeout=0.05)
+        executor.kill_grace = 0
+        release = threading.Event()
+        executor.submit(release.wait)
+        cleaned = []
+        # Still queued when the queue wait is over: dropped without running
+        with self.assertRaises(RenderTimeout):
+            executor.run(lambda: cleaned.append("ran"), timeout=5, cleanup=lambda: cleaned.append("queued"))
+        self.assertEqual(cleaned, ["queued"])
+        release.set()
+
+        # Past its budget the caller gives up, the job keeps its file until it is over
+        finished = threading.Event()
+        with self.assertRaises(RenderTimeout):
+            executor.run(lambda: time.sleep(0.2), timeout=0.01, cleanup=finished.set)
+        self.assertNotIn("ran", cleaned)
+        self.assertFalse(finished.is_set())
+        self.assertTrue(finished.wait(5))
+
+        def stops_itself():
+            raise RenderTimeout("renderer killed")
+
+        with self.assertRaises(RenderTimeout):
+            executor.run(stops_itself, timeout=5)
+        metrics = executor.metrics()
+        self.assertEqual((metrics["timed_out"], metrics["completed"]), (3, 1))
+
+
+class SQLiteConnectionsTestCase(SimpleTestCase):
+    def test_one_connection_per_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connections = SQLiteConnections(os.path.join(directory, "side.sqlite3"))
+            conn = connections.connection()
+            self.assertIs(connections.connection(), conn)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            self.assertIn("membership_insuree", tables)
+            other = []
+            thread = threading.Thread(target=lambda: other.append(connections.connection()))
+            thread.start()
+            thread.join()
+            self.assertIsNot(other[0], conn)
+            connections.close()
+            other[0].close()
+
+    def test_pragma_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connections = SQLiteConnections(
+                os.path.join(directory, "side.sqlite3"), {"journal_mode": "wal", "busy_timeout": 1234}
+            )
+            conn = connections.connection()
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 1234)
+            connections.close()
+        with self.assertRaises(ValueError):
+            SQLiteConnections(":memory:", {"journal_mode": "wal; DROP TABLE card_jobs"})
+
+    def test_writer_commits_batches_and_isolates_failures(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connections = SQLiteConnections(os.path.join(directory, "side.sqlite3"))
+            conn = connections.connection()
+            writer = SQLiteWriter(connections.connect)
+            query = "INSERT INTO payment_transactions (family_id, paypal_transaction_id) VALUES (?, ?)"
+            acks = [writer.submit(query, (1, f"PAY-{i}")) for i in range(50)]
+            duplicate = writer.submit(query, (1, "PAY-0"))
+            writer.flush(5)
+            self.assertTrue(all(ack.done and ack.error is None for ack in acks))
+            with self.assertRaises(sqlite3.IntegrityError):
+                duplicate.wait(5)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM payment_transactions").fetchone()[0], 50)
+            self.assertEqual(writer.metrics()["failed"], 1)
+            connections.close()
+
+    def test_unversioned_database_migrated_once(self):
+        conn = sqlite3.connect(":memory:")
+        create_tables(conn)  # as created before the schema was versioned
+        self.assertEqual(schema_version(conn), 0)
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT 1 FROM membership_insuree WHERE user_id = 1").fetchall()
+        self.assertIn("membership_insuree_user_id", plan[0][-1])
+        conn.close()
+
+
+class ORMHelperTestCase(TestCase):
+    def test_same_rows_as_sqlite_helper(self):
+        db_helper = ORMHelper()
+        db_helper.insert_user(5, "0700000000", "123456")
+        db_helper.update_user_id_by_phone("0700000000", 42)
+        row_id, insuree_id, phone, otp_code, user_id, otp_expiry, _ = db_helper.get_user_by_phone("0700000000")
+        self.assertEqual((insuree_id, phone, otp_code, user_id), (5, "0700000000", "123456", 42))
+        self.assertGreater(otp_expiry, time.time())
+        self.assertTrue(db_helper.is_insuree(42))
+        self.assertEqual(db_helper.get_insuree_id_by_user_id(42), 5)
+        db_helper.update_otp(row_id, "654321")
+        self.assertEqual(db_helper.get_user_by_phone("0700000000")[3], "654321")
+        db_helper.insert_fcm_token(42, "token")
+        db_helper.insert_fcm_token(42, "token")
+        self.assertEqual(db_helper.get_fcm_token_by_user_id(42), "token")
+        db_helper.insert_payment_transaction(3, "PAY-1", {"amount": 10})
+        self.assertEqual(json.loads(db_helper.get_payment_by_transaction_id("PAY-1")[-1]), {"amount": 10})
+        db_helper.delete_user("0700000000")
+        self.assertFalse(db_helper.is_insuree(42))
+
+
+class OTPStoreTestCase(TestCase):
+    def assert_single_use(self, store):
+        store.issue("0700000000", "123456")
+        self.assertEqual(store.check("0700000000", "000000"), OTPCheck.INVALID)
+        self.assertEqual(store.check("0700000000", "123456"), OTPCheck.VALID)
+        self.assertEqual(store.check("0700000000", "123456"), OTPCheck.EXPIRED)
+        store.issue("0700000000", "654321")
+        for _ in range(store.max_attempts):
+            self.assertEqual(store.check("0700000000", "000000"), OTPCheck.INVALID)
+        self.assertEqual(store.check("0700000000", "654321"), OTPCheck.TOO_MANY_ATTEMPTS)
+        self.assertEqual(store.check("0700000000", "654321"), OTPCheck.EXPIRED)
+
+    def test_cache_store(self):
+        self.addCleanup(setattr, MembershipCardConfig, "side_db_backend", MembershipCardConfig.side_db_backend)
+        MembershipCardConfig.side_db_backend = "orm"
+        ORMHelper().insert_user(5, "0700000000")
+        MembershipInsuree.objects.filter(phone="0700000000").update(otp_expiry=int(time.time()) - 7200)
+        self.assert_single_use(CacheOTPStore(cache_alias="default", max_attempts=3))
+        # Resending moved the expiry of the registration along, the sweep keeps it
+        self.assertEqual(CacheOTPStore(pending_ttl=3600).sweep(), 0)
+
+    def test_database_store(self):
+        self.addCleanup(setattr, MembershipCardConfig, "side_db_backend", MembershipCardConfig.side_db_backend)
+        MembershipCardConfig.side_db_backend = "orm"
+        ORMHelper().insert_user(5, "0700000000")
+        self.assert_single_use(DatabaseOTPStore(max_attempts=3))
+        # Never validated, swept once its OTP is long expired
+        self.assertEqual(DatabaseOTPStore(pending_ttl=-3600).sweep(), 1)
+        self.assertIsNone(ORMHelper().get_user_by_phone("0700000000"))
+
+    def test_sweeper_runs_in_background(self):
+        swept = threading.Event()
+
+        class SweepCountingStore(CacheOTPStore):
+            sweeps = 0
+
+            def sweep(self):
+                SweepCountingStore.sweeps += 1
+                swept.set()
+                return 0
+
+        store = SweepCountingStore(sweep_interval=0.05)
+        self.addCleanup(store.stop_sweeper)
+        store.start_sweeper()
+        store.start_sweeper()  # one thread per process
+        self.assertTrue(swept.wait(5))
+        sweepers = [thread for thread in threading.enumerate() if thread.name == "membership-otp-sweeper"]
+        self.assertEqual(len(sweepers), 1)
+        store.stop_sweeper()
+        sweepers[0].join(5)
+        self.assertGreater(SweepCountingStore.sweeps, 0)
+
+    def test_failed_registration_keeps_otp(self):
+        from core.test_helpers import create_test_interactive_user
+        from rest_framework.test import APIRequestFactory
+        from .utils.otp_store import get_otp_store
+        from .views import ValidateOTPAPIView
+
+        self.addCleanup(setattr, MembershipCardConfig, "side_db_backend", MembershipCardConfig.side_db_backend)
+        MembershipCardConfig.side_db_backend = "orm"
+        create_test_interactive_user(username="TakenUsername")
+        ORMHelper().insert_user(create_test_insuree().id, "0700000001")
+        get_otp_store().issue("0700000001", "123456")
+
+        def validate(username, password):
+            request = APIRequestFactory().post("/validate-otp/", {
+                "phone": "0700000001", "otp": "123456", "email": "insuree@example.org",
+                "username": username, "password": password,
+            }, format="json")
+            return ValidateOTPAPIView.as_view()(request)
+
+        self.assertEqual(validate("TakenUsername", "a-long-password").status_code, 400)
+        self.assertEqual(validate("NewInsureeUser", "short").status_code, 400)
+        self.assertEqual(validate("NewInsureeUser", "a-long-password").status_code, 201)
+        self.assertIsNotNone(ORMHelper().get_user_by_phone("0700000001")[4])
+
+
+class CardJobServiceTestCase(TestCase):
+    def setUp(self):
+        for setting in ("side_db_backend", "card_job_max_per_user"):
+            self.addCleanup(setattr, MembershipCardConfig, setting, getattr(MembershipCardConfig, setting))
+        MembershipCardConfig.side_db_backend = "orm"
+        self.user = SimpleNamespace(id="7f3c5a6e-0000-0000-0000-000000000001")
+
+    def test_orphaned_jobs_failed_once_per_process(self):
+        import socket
+        import subprocess
+        import sys
+
+        stopped = subprocess.Popen([sys.executable, "-c", "pass"])
+        stopped.wait()
+        db_helper = ORMHelper()
+        host = socket.gethostname()
+        db_helper.insert_card_job("dead", "uuid", "1", CardJobStatus.RUNNING, f"{host}:{stopped.pid}")
+        db_helper.insert_card_job("alive", "uuid", "1", CardJobStatus.QUEUED, f"{host}:{os.getpid()}")
+        db_helper.insert_card_job("elsewhere", "uuid", "1", CardJobStatus.QUEUED, "other-host:1")
+        db_helper.insert_card_job("unrecorded", "uuid", "1", CardJobStatus.QUEUED)
+        CardJobService._recovered_pid = None
+        self.assertEqual(sorted(CardJobService.recover_orphaned()), ["dead", "unrecorded"])
+        self.assertEqual(db_helper.get_card_job("dead")[3], CardJobStatus.FAILED)
+        self.assertEqual(db_helper.get_card_job("alive")[3], CardJobStatus.QUEUED)
+        self.assertEqual(CardJobService.recover_orphaned(), [])
+
+    def test_unfinished_jobs_capped_per_user(self):
+        MembershipCardConfig.card_job_max_per_user = 2
+        db_helper = ORMHelper()
+        for job_id in ("one", "two"):
+            db_helper.insert_card_job(job_id, "uuid", self.user.id, CardJobStatus.QUEUED, "other-host:1")
+        with self.assertRaises(CardJobLimitReached):
+            CardJobService.submit(self.user, "uuid")
+        db_helper.update_card_job("two", CardJobStatus.DONE)
+        self.assertEqual(db_helper.count_card_jobs(self.user.id, CardJobService.unfinished), 1)
+
+
+class InlineExecutor:
+    """Runs card jobs as they are submitted, in place of CardJobService's thread pool."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class CardJobFlowTestCase(TransactionTestCase):
+    # Jobs close the thread's database connections once done, out of a test transaction
+    def setUp(self):
+        from core.test_helpers import create_test_interactive_user
+
+        settings = ("side_db_backend", "card_renderer", "card_cache_backend", "card_job_dir", "card_job_ttl")
+        for setting in settings:
+            self.addCleanup(setattr, MembershipCardConfig, setting, getattr(MembershipCardConfig, setting))
+        self.addCleanup(setattr, CardJobService, "_executor", CardJobService._executor)
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        MembershipCardConfig.side_db_backend = "orm"
+        MembershipCardConfig.card_renderer = "stub"
+        MembershipCardConfig.card_cache_backend = None
+        MembershipCardConfig.card_job_dir = job_dir.name
+        CardJobService._executor = InlineExecutor()
+        self.user = create_test_interactive_user(username="CardJobUser")
+        self.insuree = create_test_insuree(is_head=True)
+
+    def call(self, view, user, method="get", **kwargs):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        request = getattr(APIRequestFactory(), method)("/")
+        force_authenticate(request, user=user)
+        return view.as_view()(request, **kwargs)
+
+    def test_submit_status_download(self):
+        from core.test_helpers import create_test_interactive_user
+        from .gql_queries import PdfSlipJobGQLType
+        from .views import CardJobDownloadView, CardJobStatusView, CardJobView
+
+        response = self.call(CardJobView, self.user, "post", insuree_uuid=self.insuree.uuid)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["job_id"]
+
+        response = self.call(CardJobStatusView, self.user, job_id=job_id)
+        self.assertEqual(response.data["status"], CardJobStatus.DONE)
+        self.assertIn("download_url", response.data)
+        response = self.call(CardJobDownloadView, self.user, job_id=job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), StubRenderer.PDF)
+        response.close()
+        job = CardJobService.get_job(job_id, self.user)
+        self.assertEqual(base64.b64decode(PdfSlipJobGQLType.resolve_base64_pdf(job, None)), StubRenderer.PDF)
+
+        # Jobs are only visible to the user who submitted them
+        other_user = create_test_interactive_user(username="OtherCardJobUser")
+        self.assertEqual(self.call(CardJobStatusView, other_user, job_id=job_id).status_code, 404)
+        self.assertEqual(self.call(CardJobDownloadView, other_user, job_id=job_id).status_code, 404)
+
+    def test_failed_job(self):
+        from .views import CardJobStatusView
+
+        MembershipCardConfig.card_renderer = "missing"
+        job_id = CardJobService.submit(self.user, self.insuree.uuid)
+        response = self.call(CardJobStatusView, self.user, job_id=job_id)
+        self.assertEqual(response.data["status"], CardJobStatus.FAILED)
+        self.assertIn("missing", response.data["error"])
+        self.assertNotIn("download_url", response.data)
+
+    def test_purge_drops_artifacts(self):
+        from .gql_queries import PdfSlipJobGQLType
+        from .views import CardJobDownloadView
+
+        job_id = CardJobService.submit(self.user, self.insuree.uuid)
+        job = CardJobService.get_job(job_id, self.user)
+        self.assertTrue(os.path.exists(CardJobService.artifact_path(job_id)))
+        MembershipCardConfig.card_job_ttl = -1
+        CardJobService.purge_expired()
+        self.assertFalse(os.path.exists(CardJobService.artifact_path(job_id)))
+        self.assertIsNone(CardJobService.get_job(job_id, self.user))
+        self.assertEqual(self.call(CardJobDownloadView, self.user, job_id=job_id).status_code, 404)
+        # A status read before the purge no longer has a card to resolve
+        self.assertIsNone(PdfSlipJobGQLType.resolve_base64_pdf(job, None))
+
+
+class CardStreamTestCase(TestCase):
+    def setUp(self):
+        from core.test_helpers import create_test_interactive_user
+
+        for setting in ("card_renderer", "card_cache_backend"):
+            self.addCleanup(setattr, MembershipCardConfig, setting, getattr(MembershipCardConfig, setting))
+        MembershipCardConfig.card_renderer = "stub"
+        MembershipCardConfig.card_cache_backend = None
+        self.user = create_test_interactive_user(username="CardStreamUser")
+        self.insuree = create_test_insuree(is_head=True)
+
+    def get(self, card_format, **headers):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .views import PrintPdfSlipView
+
+        request = APIRequestFactory().get("/", {"format": card_format}, **headers)
+        force_authenticate(request, user=self.user)
+        return PrintPdfSlipView.as_view()(request, insuree_uuid=self.insuree.uuid)
+
+    def test_pdf(self):
+        response = self.get("pdf")
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        self.assertEqual(body, StubRenderer.PDF)
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def test_base64(self):
+        response = self.get("base64")
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        self.assertEqual(base64.b64decode(body), StubRenderer.PDF)
+        self.assertEqual(int(response["Content-Length"]), 4 * ((len(StubRenderer.PDF) + 2) // 3))
+        self.assertEqual(int(response["Content-Length"]), len(body))
+
+    def test_not_modified(self):
+        etag = self.get("pdf")["ETag"]
+        response = self.get("pdf", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get("base64", HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+
+class CardViewPermissionsTestCase(TestCase):
+    def setUp(self):
+        from core.test_helpers import create_test_interactive_user
+
+        self.insuree_user = create_test_interactive_user(username="InsureeAccount", roles=[])
+        self.admin_user = create_test_interactive_user(username="CardAdmin")
+
+    def get(self, view, user, **params):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        request = APIRequestFactory().get("/", params)
+        force_authenticate(request, user=user)
+        return view.as_view()(request)
+
+    def test_card_export_needs_rights(self):
+        from .views import CardExportView
+
+        self.assertEqual(self.get(CardExportView, self.insuree_user, location="x").status_code, 403)
+        # Past the permission check the request itself is validated
+        self.assertEqual(self.get(CardExportView, self.admin_user).status_code, 400)
+
+    def test_render_metrics_need_rights(self):
+        from .views import CardRenderMetricsView
+
+        self.assertEqual(self.get(CardRenderMetricsView, self.insuree_user).status_code, 403)
+        self.assertEqual(self.get(CardRenderMetricsView, self.admin_user).status_code, 200)
+
+
+class OTPDeliveryTestCase(SimpleTestCase):
+    def test_delivered_in_background_with_retries(self):
+        class FlakyTransport(OTPTransport):
+            def __init__(self):
+                self.calls = []
+
+            def accepts(self, message):
+                return bool(message.email)
+
+            def send(self, message):
+                self.calls.append(message.otp)
+                if self.calls.count(message.otp) == 1:
+                    raise ConnectionError("provider down")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "otp.jsonl")
+            flaky = FlakyTransport()
+            delivery = OTPDelivery([FileTransport(path), flaky], workers=2, backoff=0.001)
+            for i in range(10):
+                delivery.submit(OTPMessage(str(100000 + i), f"07000000{i:02}", "a@example.org" if i % 2 else None))
+            delivery.flush()
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 10)
+        self.assertEqual(len(flaky.calls), 10)
+        self.assertEqual(delivery.metrics(), {"pending": 0, "sent": 15, "retried": 5, "failed": 0})
+
+
+class EligibilityCalendarTestCase(SimpleTestCase):
+    def test_merge_intervals(self):
+        self.assertEqual(
+            merge_intervals([
+                (date(2024, 3, 1), date(2024, 5, 31)),
+                (date(2024, 1, 1), date(2024, 2, 29)),
+                (date(2024, 9, 1), date(2024, 8, 1)),  # empty
+            ]),
+            [(date(2024, 1, 1), date(2024, 5, 31))],
+        )
+
+    def test_month_masks(self):
+        calendar = EligibilityCalendar(
+            [
+                SimpleNamespace(validity_from=datetime(2023, 11, 15), validity_to=datetime(2024, 2, 3)),
+                SimpleNamespace(validity_from=date(2024, 6, 30), validity_to=None),
+            ],
+            today=date(2025, 3, 10),
+        )
+        self.assertEqual(calendar.month_mask(2022), 0)
+        self.assertEqual(calendar.month_mask(2023), 0b110000000000)
+        # January, February, then June until the end of the year
+        self.assertEqual(calendar.month_mask(2024), 0b111111100011)
+        # Open-ended policy runs until today
+        self.assertEqual(calendar.masks([2025, 2026]), {2025: 0b111, 2026: 0})
+
+
+class CardAssetsTestCase(SimpleTestCase):
+    def test_local_asset_inlined(self):
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as image:
+            image.write(b"\x89PNG")
+        assets = CardAssets({"logo": image.name})
+        os.remove(image.name)  # read once, at construction
+        self.assertEqual(assets["logo"], "data:image/png;base64," + base64.b64encode(b"\x89PNG").decode())
+
+    def test_remote_asset_kept_without_fetch(self):
+        url = "https://example.org/logo.png"
+        assets = CardAssets({"logo": url}, fetch_remote=False)
+        self.assertEqual(assets["logo"], url)
+
+    def test_failed_download_retried(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        class FlakyHandler(BaseHTTPRequestHandler):
+            requests = 0
+
+            def do_GET(self):
+                FlakyHandler.requests += 1
+                if FlakyHandler.requests == 1:
+                    time.sleep(0.3)  # slower than a render should ever wait
+                self.send_response(503 if FlakyHandler.requests == 1 else 200)
+                self.send_header("Content-Type", "image/png")
+                self.end_headers()
+                self.wfile.write(b"\x89PNG")
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/logo.png"
+        inlined = "data:image/png;base64," + base64.b64encode(b"\x89PNG").decode()
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition():
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+        started = time.monotonic()
+        assets = CardAssets({"logo": url}, fetch_remote=True, retry_interval=0.2)
+        # Downloads run in the background, cards keep the remote URL meanwhile
+        self.assertEqual(assets["logo"], url)
+        self.assertLess(time.monotonic() - started, 0.2)
+        wait_for(lambda: assets._failed_at)
+        self.assertEqual(assets["logo"], url)  # not tried again within the retry interval
+        self.assertEqual(FlakyHandler.requests, 1)
+        time.sleep(0.2)
+        self.assertEqual(assets["logo"], url)
+        wait_for(lambda: "logo" in assets._resolved)
+        self.assertEqual(assets["logo"], inlined)
+        self.assertEqual(FlakyHandler.requests, 2)
+
+    def test_truncated_download_kept_remote(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        class TruncatingHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "100")
+                self.end_headers()
+                self.wfile.write(b"\x89PNG")
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), TruncatingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/logo.png"
+        self.assertEqual(resolve_asset(url, fetch_remote=True), url)
+
+    def test_find_remote_urls(self):
+        html = (
+            '<img src="https://example.org/a.png"><div style="background-image: url(\'http://example.org/b.png\')">'
+            '<img src="data:image/png;base64,AAAA"><a href="https://example.org/c">'
+        )
+        self.assertEqual(find_remote_urls(html), ["http://example.org/b.png", "https://example.org/a.png"])
+
+
+class CardFragmentsTestCase(SimpleTestCase):
+    def test_conditions_html_escaped_and_memoised(self):
+        conditions_html = card_conditions_html("fr")
+        self.assertIn("s&#x27;inscrire", conditions_html)
+        self.assertTrue(conditions_html.startswith('<ol type="1"><li>'))
+        self.assertIs(card_conditions_html("fr"), conditions_html)
+
+    def test_eligibility_html_memoised(self):
+        html = PDFGenerationService.eligibility_html_from_mask(2024, 0b101)
+        self.assertEqual(html.count("eligibility-stamp"), 2)
+        self.assertIs(PDFGenerationService.eligibility_html_from_mask(2024, 0b101), html)
+
+
+class CardBenchmarkTestCase(SimpleTestCase):
+    def test_stub_renderer(self):
+        with tempfile.NamedTemporaryFile(suffix=".html") as html_file:
+            self.assertTrue(StubRenderer().render(html_file.name, {}).startswith(b"%PDF-"))
+            with self.assertRaises(RenderTimeout):
+                StubRenderer(delay=0.2).render(html_file.name, {}, timeout=0.01)
+
+    def test_stage_timer_summary(self):
+        timer = StageTimer()
+        for _ in range(4):
+            with timer.stage("load"):
+                pass
+        timer.cards, timer.elapsed = 4, 2.0
+        summary = timer.summary()
+        self.assertEqual(summary["cards_per_second"], 2.0)
+        self.assertEqual(summary["stages"]["load"]["count"], 4)
+        self.assertIsNone(summary["stages"]["pdf"]["p95"])
+
+
+class CardExportTestCase(SimpleTestCase):
+    def test_stream_card_zip(self):
+        cards = [
+            ("100.pdf", b"%PDF-1.4 first", None),
+            ("101.pdf", None, RenderTimeout("Card rendering timed out.")),
+            ("102.pdf", b"%PDF-1.4 third", None),
+        ]
+        chunks = list(stream_card_zip(iter(cards)))
+        self.assertGreater(len(chunks), 2)  # one piece per entry, not the whole archive at the end
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["100.pdf", "102.pdf", "errors.txt"])
+            self.assertEqual(archive.read("102.pdf"), b"%PDF-1.4 third")
+            self.assertIn(b"101.pdf", archive.read("errors.txt"))
+
+    def test_recover_zip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cards.zip")
+            with zipfile.ZipFile(path, mode="w") as archive:
+                for index in range(3):
+                    add_card_entry(archive, f"10{index}.pdf", b"%PDF-1.4 card " * (index + 1))
+                complete = archive.fp.tell() - 10  # the last entry cut short
+            # Killed before the central directory was written
+            with open(path, "r+b") as archive_file:
+                archive_file.truncate(complete)
+            self.assertFalse(zipfile.is_zipfile(path))
+            self.assertEqual(recover_zip(path), ["100.pdf", "101.pdf"])
+            with zipfile.ZipFile(path) as archive:
+                self.assertIsNone(archive.testzip())
+                self.assertEqual(archive.read("101.pdf"), b"%PDF-1.4 card " * 2)
+                self.assertEqual(archive.namelist(), ["100.pdf", "101.pdf"])
+
+
+class CardPrerenderQueueTestCase(SimpleTestCase):
+    def test_changes_are_coalesced(self):
+        rendered = []
+        done = threading.Event()
+
+        def render(family_id):
+            rendered.append(family_id)
+            if len(rendered) == 2:
+                done.set()
+
+        queue = CardPrerenderQueue(render, delay=0.1)
+        for _ in range(10):
+            queue.schedule(1)
+            queue.schedule(2)
+        self.assertEqual(queue.pending(), 2)
+        self.assertTrue(done.wait(2))
+        time.sleep(0.2)
+        self.assertEqual(sorted(rendered), [1, 2])
+
+    def test_max_delay_bounds_debounce(self):
+        done = threading.Event()
+        queue = CardPrerenderQueue(lambda family_id: done.set(), delay=10, max_delay=0.1)
+        queue.schedule(1)
+        queue.schedule(1)
+        self.assertTrue(done.wait(2))
+
+
+class PhotoThumbnailsTestCase(SimpleTestCase):
+    @staticmethod
+    def photo(photo_id, color):
+        image = io.BytesIO()
+        Image.new("RGB", (1200, 1600), color).save(image, "JPEG")
+        return SimpleNamespace(
+            id=photo_id, full_file_path=lambda: None, photo=base64.b64encode(image.getvalue()).decode()
+        )
+
+    def test_thumbnails_keyed_by_content(self):
+        if Image is None:
+            self.skipTest("Pillow is not installed")
+        with tempfile.TemporaryDirectory() as directory:
+            thumbnails = PhotoThumbnails(directory, size=(300, 400), workers=1)
+            try:
+                path = thumbnails.path(self.photo(1, "red"))
+                with Image.open(path) as thumbnail:
+                    self.assertEqual(thumbnail.size, (300, 400))
+                self.assertEqual(thumbnails.path(self.photo(1, "red")), path)
+                self.assertNotEqual(thumbnails.path(self.photo(1, "blue")), path)
+            finally:
+                thumbnails.shutdown()
+
+
+class IdentityResolverTestCase(SimpleTestCase):
+    def test_resolutions_cached_until_invalidated(self):
+        loads = []
+
+        class Resolver(IdentityResolver):
+            @staticmethod
+            def load(user_id):
+                loads.append(user_id)
+                return InsureeIdentity(5, 3, "070000001") if user_id == 42 else None
+
+        resolver = Resolver(cache_alias="default")
+        resolver.invalidate(42, 43)
+        for _ in range(3):
+            self.assertEqual(resolver.resolve(42).chf_id, "070000001")
+            self.assertIsNone(resolver.resolve(43))
+        self.assertEqual(loads, [42, 43])
+        resolver.invalidate(42)
+        resolver.resolve(42)
+        self.assertEqual(loads, [42, 43, 42])
+        # Another process only finds the shared copy
+        self.assertEqual(Resolver(cache_alias="default").resolve(42), InsureeIdentity(5, 3, "070000001"))
+        self.assertEqual(len(loads), 3)
+
+
+class InsureeClaimsTestCase(SimpleTestCase):
+    def request(self, claims, username):
+        import jwt
+        from core.jwt_authentication import JWTAuthentication
+        from graphql_jwt.settings import jwt_settings
+
+        token = jwt.encode(claims, "secret", algorithm="HS256")
+        return SimpleNamespace(
+            successful_authenticator=JWTAuthentication(),
+            user=SimpleNamespace(username=username, i_user_id=None),
+            META={jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {token}"},
+            COOKIES={},
+        )
+
+    def test_identity_read_from_token(self):
+        self.addCleanup(setattr, MembershipCardConfig, "jwt_insuree_claims", MembershipCardConfig.jwt_insuree_claims)
+        MembershipCardConfig.jwt_insuree_claims = True
+        claims = {"username": "insuree", "is_insuree": True, "insuree_id": 5, "family_id": 3, "chf_id": "070000001"}
+        self.assertEqual(request_insuree_identity(self.request(claims, "insuree")), InsureeIdentity(5, 3, "070000001"))
+        self.assertIsNone(request_insuree_identity(self.request({**claims, "is_insuree": False}, "insuree")))
+        # Claims of another user are ignored, the user is resolved instead
+        self.assertIsNone(request_insuree_identity(self.request(claims, "someone else")))
+
+
+class SheetLayoutTestCase(SimpleTestCase):
+    config = {
+        "rows": 2, "cols": 2, "sheet_width": 210, "sheet_height": 297, "margin": 10, "gutter": 6,
+        "card_width": 210, "card_height": 297, "crop_mark_length": 4, "crop_mark_offset": 1,
+    }
+
+    def test_grid(self):
+        layout = SheetLayout.from_config(self.config, rows=3, cols=2)
+        self.assertEqual(layout.per_sheet, 6)
+        self.assertEqual(layout.cell_width, 92)
+        self.assertEqual(layout.cell_origins()[3], (108, 10 + layout.cell_height + 6))
+        self.assertEqual([len(sheet) for sheet in layout.sheets(list(range(13)))], [6, 6, 1])
+        self.assertEqual(parse_grid("3x2"), (3, 2))
+        with self.assertRaises(ValueError):
+            parse_grid("3 by 2")
+
+    def test_crop_marks_stay_off_the_cards(self):
+        layout = SheetLayout.from_config(self.config, rows=3, cols=3)
+        cells = [(x, y, x + layout.cell_width, y + layout.cell_height) for x, y in layout.cell_origins()]
+        marks = layout.crop_marks()
+        self.assertEqual(len(marks), 9 * 8)
+        for x, y, width, height in marks:
+            for left, top, right, bottom in cells:
+                self.assertFalse(x < right and x + width > left and y < bottom and y + height > top)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        calls = []
+        results = []
+        started = threading.Event()
+
+        def render():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return b"%PDF"
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do("card", render))) for _ in range(5)]
+        threads[0].start()
+        started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"%PDF"] * 5)
+        self.assertEqual(flights.metrics()["shared"], 4)
+
+    def test_waits_for_other_process_through_cache_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCardCache(directory, max_bytes=1024)
+            self.assertTrue(cache.acquire_lock("fp", timeout=30))  # held by "another process"
+            self.assertFalse(cache.acquire_lock("fp", timeout=30))
+            threading.Timer(0.3, cache.set, args=("fp", b"%PDF other")).start()
+            self.assertEqual(render_once("fp", lambda: self.fail("rendered twice"), cache), b"%PDF other")
+
+
+class CardDataQueryCountTestCase(TestCase):
+    def setUp(self):
+        self.head = create_test_insuree(is_head=True)
+        for _ in range(3):
+            create_test_insuree(with_family=False, custom_props={"family": self.head.family})
+
+    def test_card_data_query_count(self):
+        with self.assertNumQueries(3):
+            card_data = PDFGenerationService.load_card_data(self.head.uuid)
+        self.assertEqual(len(card_data.members), 4)
+
+        # Rendering the card reads members' gender and health facility, all already loaded
+        template = get_card_template(MembershipCardConfig.get_template_by_os())
+        with self.assertNumQueries(0):
+            card = PDFGenerationService.build_card_context(*card_data)
+            template.render({"cards": [card], "conditions": []})
+
+    def test_fingerprint_covers_printed_names(self):
+        self.addCleanup(setattr, MembershipCardConfig, "card_language", MembershipCardConfig.card_language)
+        card_data = PDFGenerationService.load_card_data(self.head.uuid)
+        template_name = MembershipCardConfig.get_template_by_os()
+        card_data.members[-1].gender = Gender(code="Z", gender="Before")
+        with self.assertNumQueries(0):
+            fingerprint = PDFGenerationService.card_fingerprint(*card_data, template_name)
+        card_data.members[-1].gender.gender = "Renamed"
+        renamed = PDFGenerationService.card_fingerprint(*card_data, template_name)
+        self.assertNotEqual(renamed, fingerprint)
+        MembershipCardConfig.card_language = "other"
+        self.assertNotEqual(PDFGenerationService.card_fingerprint(*card_data, template_name), renamed)
+
+
+class PrintMembershipCardsTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, MembershipCardConfig, "card_renderer", MembershipCardConfig.card_renderer)
+        MembershipCardConfig.card_renderer = "stub"
+        self.head = create_test_insuree(is_head=True)
+        for _ in range(4):
+            create_test_insuree(with_family=False, custom_props={"family": self.head.family})
+
+    def test_family_batch_query_count(self):
+        # One query for the insurees, then one for the members and one for the policies of all families
+        with self.assertNumQueries(3):
+            insurees = list(PDFGenerationService.get_batch_insurees(family_uuid=self.head.family.uuid))
+            cards = PDFGenerationService.build_batch_contexts(insurees)
+        self.assertEqual(len(cards), 5)
+        self.assertEqual(cards[0]["insuree"], self.head)
+        self.assertTrue(all(len(card["insurees"]) == 5 for card in cards))
+
+    def test_family_printed_in_chunks(self):
+        from django.core.management import call_command
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            stdout = io.StringIO()
+            call_command(
+                "print_membership_cards", os.path.join(output_dir, "cards.pdf"),
+                family_uuid=self.head.family.uuid, chunk_size=2, stdout=stdout,
+            )
+            self.assertEqual(sorted(os.listdir(output_dir)), ["cards_001.pdf", "cards_002.pdf", "cards_003.pdf"])
+        self.assertEqual([line.split(": ")[1] for line in stdout.getvalue().splitlines()[:3]],
+                         ["2 cards", "2 cards", "1 cards"])
+        self.assertIn("Printed 5 cards in 3 document(s)", stdout.getvalue())
+
+    def test_unknown_location(self):
+        from django.core.management import CommandError, call_command
+
+        with self.assertRaisesMessage(CommandError, "not found"):
+            call_command("print_membership_cards", "cards.pdf", location_uuid="00000000-0000-0000-0000-000000000000")
+
+
+class LoginProfileTestCase(TestCase):
+    def setUp(self):
+        from core.test_helpers import create_test_interactive_user
+        from django.core.cache import caches
+
+        self.insuree = create_test_insuree(is_head=True)
+        self.user = create_test_interactive_user(username="LoginProfileTest")
+        identity = InsureeIdentity(self.insuree.id, self.insuree.family_id, self.insuree.chf_id)
+        # Registered through the shared cache, as another process resolving the user would have
+        get_identity_resolver().invalidate(self.user.i_user_id)
+        caches["default"].set(IdentityResolver.cache_key(self.user.i_user_id), identity, 60)
+
+    def test_profile_query_count(self):
+        with self.assertNumQueries(2):
+            profile = load_login_profile("LoginProfileTest")
+        self.assertTrue(profile["is_insuree"])
+        self.assertEqual(profile["insuree_info"]["chfid"], self.insuree.chf_id)
+        self.assertEqual(profile["insuree_info"]["family"], self.insuree.family_id)
+        self.assertEqual(profile["last_name"], self.user.i_user.last_name)
+        self.assertIsNone(load_login_profile("nobody"))
+
+    def test_profile_cached(self):
+        self.addCleanup(
+            setattr, MembershipCardConfig, "login_profile_cache_timeout",
+            MembershipCardConfig.login_profile_cache_timeout,
+        )
+        MembershipCardConfig.login_profile_cache_timeout = 30
+        profile = load_login_profile("LoginProfileTest")
+        with self.assertNumQueries(0):
+            self.assertEqual(load_login_profile("LoginProfileTest"), profile)
+
+
 class MembershipTypeTestCase(TestCase):
     def setUp(self):
         # Create test data
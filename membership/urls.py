@@ -8,6 +8,11 @@ from .paypal_service import *
 
 urlpatterns = [
     path('membership/card/<insuree_uuid>', PrintPdfSlipView.as_view(), name="print"),
+    path('membership/card-render/metrics', CardRenderMetricsView.as_view(), name="card-render-metrics"),
+    path('membership/card-job/<insuree_uuid>/submit', CardJobView.as_view(), name="card-job-submit"),
+    path('membership/card-job/<job_id>', CardJobStatusView.as_view(), name="card-job-status"),
+    path('membership/card-job/<job_id>/download', CardJobDownloadView.as_view(), name="card-job-download"),
+    path('membership/cards/export', CardExportView.as_view(), name="card-export"),
     # path('attach/', views.attach, name='attach')
 ]
 
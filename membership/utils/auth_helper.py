@@ -2,6 +2,7 @@ from core.jwt import *
 from core.models import User
 from core.services import user_authentication
 from graphql_jwt.utils import jwt_payload
+from membership.utils.insuree_claims import add_insuree_claims
 from rest_framework import exceptions
 
 
@@ -9,7 +10,7 @@ def authenticate_and_get_token(username, password, request):
     try:
         user = user_authentication(request, username, password)
         if user:
-            payload = jwt_payload(user=user)
+            payload = add_insuree_claims(jwt_payload(user=user), user)
             token = jwt_encode_user_key(payload=payload, context=request)
             return {"token": token, "exp": payload['exp']}
     except exceptions.AuthenticationFailed as e:
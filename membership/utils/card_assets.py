@@ -0,0 +1,156 @@
+# card_assets.py
+import base64
+import http.client
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+from membership.apps import MembershipCardConfig
+
+logger = logging.getLogger(__name__)
+
+REMOTE_URL_RE = re.compile(r"""(?:src\s*=\s*|url\(\s*)["']?(https?://[^"')\s>]+)""", re.IGNORECASE)
+
+
+class RemoteAssetError(Exception):
+    """Raised when a card document still references remote URLs and card_remote_urls is "error"."""
+
+
+def is_remote(source):
+    return source.startswith(("http://", "https://"))
+
+
+def data_uri(content, mime_type):
+    return f"data:{mime_type};base64,{base64.b64encode(content).decode('ascii')}"
+
+
+def find_remote_urls(html):
+    """Remote URLs wkhtmltopdf would fetch to render `html` (img src and css url())."""
+    return sorted(set(REMOTE_URL_RE.findall(html)))
+
+
+def resolve_asset(source, fetch_remote=False, timeout=5):
+    """
+    Turn an asset source into a data URI. The source is a data URI, an absolute path,
+    a static file name or an http(s) URL; remote sources are only downloaded when
+    `fetch_remote` is set. The source is returned unchanged when it cannot be resolved.
+    """
+    if not source or source.startswith("data:"):
+        return source
+    if is_remote(source):
+        if not fetch_remote:
+            return source
+        try:
+            with urlopen(source, timeout=timeout) as response:
+                mime_type = response.headers.get_content_type()
+                return data_uri(response.read(), mime_type)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            logger.warning("Card asset %s could not be downloaded, it stays remote: %s", source, e)
+            return source
+    path = source
+    if not os.path.isabs(path):
+        from django.contrib.staticfiles import finders
+        path = finders.find(source)
+    if not path or not os.path.isfile(path):
+        logger.warning("Card asset %s not found", source)
+        return source
+    with open(path, "rb") as asset_file:
+        content = asset_file.read()
+    return data_uri(content, mimetypes.guess_type(path)[0] or "application/octet-stream")
+
+
+class CardAssets:
+    """
+    Images of the card templates, resolved once per process and kept in memory as data URIs
+    so that wkhtmltopdf never goes to the network for them. Local sources are read right away.
+    When card_asset_fetch_remote is set, remote ones are downloaded by a background thread per
+    asset, and cards keep the remote URL until the download succeeded: renders never wait on it.
+    A failed download is tried again `retry_interval` seconds later, when a card asks for the
+    asset. Templates read them as {{ assets.logo }}.
+    """
+
+    def __init__(self, sources, fetch_remote=False, timeout=5, retry_interval=60):
+        self.sources = dict(sources)
+        self.fetch_remote = fetch_remote
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._fetching = set()
+        self._failed_at = {}
+        self._pid = os.getpid()
+        self._resolved = {
+            name: resolve_asset(source)
+            for name, source in self.sources.items()
+            if not is_remote(source or "")
+        }
+        for name in self.sources:
+            self._start_fetch(name)
+
+    def _start_fetch(self, name):
+        if not self.fetch_remote or name in self._resolved:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Download threads of the parent process did not survive the fork
+                self._fetching.clear()
+                self._pid = os.getpid()
+            failed_at = self._failed_at.get(name)
+            if name in self._fetching or (failed_at is not None and time.monotonic() - failed_at < self.retry_interval):
+                return
+            self._fetching.add(name)
+        threading.Thread(target=self._fetch, args=(name,), name=f"membership-card-asset-{name}", daemon=True).start()
+
+    def _fetch(self, name):
+        source = self.sources[name]
+        resolved = resolve_asset(source, fetch_remote=True, timeout=self.timeout)
+        with self._lock:
+            self._fetching.discard(name)
+            if resolved == source:
+                self._failed_at[name] = time.monotonic()
+            else:
+                self._resolved[name] = resolved
+
+    def __getitem__(self, name):
+        if name in self._resolved:
+            return self._resolved[name]
+        source = self.sources[name]
+        self._start_fetch(name)
+        return source
+
+    def __contains__(self, name):
+        return name in self.sources
+
+
+_card_assets = None
+_card_assets_lock = threading.Lock()
+
+
+def get_card_assets():
+    """Return the process wide card assets, built on first use from the module configuration."""
+    global _card_assets
+    with _card_assets_lock:
+        if _card_assets is None:
+            _card_assets = CardAssets(
+                MembershipCardConfig.card_assets,
+                fetch_remote=MembershipCardConfig.card_asset_fetch_remote,
+                timeout=MembershipCardConfig.card_asset_fetch_timeout,
+                retry_interval=MembershipCardConfig.card_asset_retry_interval,
+            )
+    return _card_assets
+
+
+def check_remote_urls(html):
+    """Report the remote URLs left in a card document according to card_remote_urls."""
+    mode = MembershipCardConfig.card_remote_urls
+    if not mode:
+        return
+    remote_urls = find_remote_urls(html)
+    if not remote_urls:
+        return
+    if mode == "error":
+        raise RemoteAssetError(f"Card document references remote URLs: {', '.join(remote_urls)}")
+    logger.warning("Card document references remote URLs: %s", ", ".join(remote_urls))
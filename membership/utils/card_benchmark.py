@@ -0,0 +1,112 @@
+# card_benchmark.py
+import time
+from contextlib import contextmanager
+
+from membership.apps import MembershipCardConfig
+from membership.utils.render_pool import percentile
+
+STAGES = ("load", "html", "pdf")
+
+
+def create_synthetic_families(families, members, policies=True):
+    """
+    Create `families` families of `members` insurees each (head included) with the insuree
+    test helpers, and a policy covering each family when `policies` is set. Returns the heads.
+    """
+    from insuree.test_helpers import create_test_insuree
+
+    if policies:
+        from policy.test_helpers import create_test_policy
+        from product.test_helpers import create_test_product
+        product = create_test_product("BENCH")
+    heads = []
+    for _ in range(families):
+        head = create_test_insuree(is_head=True)
+        for _ in range(members - 1):
+            create_test_insuree(with_family=False, custom_props={"family": head.family})
+        if policies:
+            create_test_policy(product, head)
+        heads.append(head)
+    return heads
+
+
+class StageTimer:
+    """Collects durations per stage, and the cards rendered, of one benchmark mode."""
+
+    def __init__(self):
+        self.durations = {stage: [] for stage in STAGES}
+        self.cards = 0
+        self.elapsed = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name].append(time.perf_counter() - started_at)
+
+    def summary(self):
+        stages = {}
+        for name, durations in self.durations.items():
+            durations = sorted(durations)
+            stages[name] = {
+                "count": len(durations),
+                "p50": percentile(durations, 0.5),
+                "p95": percentile(durations, 0.95),
+                "total": sum(durations),
+            }
+        return {
+            "cards": self.cards,
+            "elapsed": self.elapsed,
+            "cards_per_second": self.cards / self.elapsed if self.elapsed else None,
+            "stages": stages,
+        }
+
+
+def _render(renderer, cards, template_name, timer):
+    from membership.services import PDFGenerationService
+
+    with timer.stage("html"):
+        html_file = PDFGenerationService.render_cards_html(None, cards, template_name)
+    try:
+        with timer.stage("pdf"):
+            renderer.render(html_file.name, MembershipCardConfig.wkhtml_cmd_options_for_printing)
+    finally:
+        html_file.close()
+    timer.cards += len(cards)
+
+
+def benchmark_single(insurees, renderer, template_name, iterations=1):
+    """One card per request, as PrintPdfSlipView renders them, card cache and render pool aside."""
+    from membership.services import PDFGenerationService
+
+    timer = StageTimer()
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        for insuree in insurees:
+            with timer.stage("load"):
+                card = PDFGenerationService.build_card_context(
+                    *PDFGenerationService.load_card_data(insuree.uuid)
+                )
+            _render(renderer, [card], template_name, timer)
+    timer.elapsed = time.perf_counter() - started_at
+    return timer
+
+
+def benchmark_batch(insurees, renderer, template_name, batch_size, iterations=1):
+    """Cards rendered `batch_size` per document, as print_membership_cards does."""
+    from membership.services import PDFGenerationService
+
+    timer = StageTimer()
+    uuids = [insuree.uuid for insuree in insurees]
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        for i in range(0, len(uuids), batch_size):
+            with timer.stage("load"):
+                cards = PDFGenerationService.build_batch_contexts(
+                    list(PDFGenerationService.get_batch_insurees(insuree_uuids=uuids[i:i + batch_size]))
+                )
+            _render(renderer, cards, template_name, timer)
+    timer.elapsed = time.perf_counter() - started_at
+    return timer
@@ -0,0 +1,192 @@
+# card_cache.py
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.core.cache import caches
+
+from membership.apps import MembershipCardConfig
+
+
+def compute_fingerprint(*parts):
+    """Return a stable sha256 hex digest of the given JSON-serialisable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCardCache:
+    """
+    Stores rendered card PDFs as files named after their fingerprint.
+
+    The modification time of a file doubles as its last access time, so eviction
+    removes the least recently used cards once the directory grows above max_bytes.
+    """
+
+    suffix = ".pdf"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None  # lazily computed, approximate across processes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, fingerprint):
+        return os.path.join(self.directory, f"{fingerprint}{self.suffix}")
+
+    def get(self, fingerprint):
+        path = self.path(fingerprint)
+        try:
+            with open(path, "rb") as pdf_file:
+                content = pdf_file.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return content
+
+    def open(self, fingerprint):
+        """Open the cached card for streaming, None on a cache miss."""
+        path = self.path(fingerprint)
+        try:
+            pdf_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return pdf_file
+
+    def set(self, fingerprint, content):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, self.path(fingerprint))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += len(content)
+            if self._size is None or self._size > self.max_bytes:
+                self._evict()
+
+    def delete(self, fingerprint):
+        try:
+            os.remove(self.path(fingerprint))
+        except FileNotFoundError:
+            pass
+
+    def acquire_lock(self, fingerprint, timeout):
+        """
+        Take the render lock of a card for all processes sharing the directory, False when
+        another one holds it. A lock older than `timeout` seconds is considered abandoned.
+        """
+        path = os.path.join(self.directory, f"{fingerprint}.lock")
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime <= timeout:
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def release_lock(self, fingerprint):
+        try:
+            os.remove(os.path.join(self.directory, f"{fingerprint}.lock"))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Remove least recently used cards until the cache fits into max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process meanwhile
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._size = total
+
+
+class DjangoCardCache:
+    """
+    Stores rendered card PDFs in a Django cache; size bound and LRU eviction are
+    delegated to the cache backend (MAX_ENTRIES for locmem, maxmemory for redis...).
+    """
+
+    key_prefix = "membership_card:"
+
+    def __init__(self, alias="default", timeout=None):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def path(self, fingerprint):
+        return None
+
+    def get(self, fingerprint):
+        return self.cache.get(f"{self.key_prefix}{fingerprint}")
+
+    def open(self, fingerprint):
+        content = self.get(fingerprint)
+        return io.BytesIO(content) if content is not None else None
+
+    def set(self, fingerprint, content):
+        self.cache.set(f"{self.key_prefix}{fingerprint}", content, timeout=self.timeout)
+
+    def delete(self, fingerprint):
+        self.cache.delete(f"{self.key_prefix}{fingerprint}")
+
+    def acquire_lock(self, fingerprint, timeout):
+        """Take the render lock of a card for all processes sharing the cache, False when taken."""
+        return self.cache.add(f"{self.key_prefix}lock:{fingerprint}", 1, timeout=timeout)
+
+    def release_lock(self, fingerprint):
+        self.cache.delete(f"{self.key_prefix}lock:{fingerprint}")
+
+
+_card_cache = None
+_card_cache_lock = threading.Lock()
+
+
+def get_card_cache():
+    """Return the configured card cache, or None when caching is disabled."""
+    global _card_cache
+    backend = MembershipCardConfig.card_cache_backend
+    if not backend:
+        return None
+    with _card_cache_lock:
+        if _card_cache is None:
+            if backend == "disk":
+                _card_cache = DiskCardCache(
+                    MembershipCardConfig.card_cache_dir,
+                    MembershipCardConfig.card_cache_max_bytes,
+                )
+            elif backend == "django":
+                _card_cache = DjangoCardCache(
+                    MembershipCardConfig.card_cache_alias,
+                    MembershipCardConfig.card_cache_timeout,
+                )
+            else:
+                raise ValueError(f"Unknown card cache backend: {backend}")
+    return _card_cache
@@ -0,0 +1,188 @@
+# card_export.py
+import logging
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from membership.apps import MembershipCardConfig
+from membership.utils.render_pool import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+ERRORS_ENTRY = "errors.txt"
+
+# Local file header of a ZIP entry: signature, versions, flags, compression, time, date, crc,
+# compressed and uncompressed sizes, name and extra field lengths
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+DATA_DESCRIPTOR_FLAG = 0x08
+UTF8_NAME_FLAG = 0x800
+
+
+def card_entry_name(insuree):
+    return f"{insuree.chf_id}.pdf"
+
+
+def export_insurees(location_uuid=None, health_facility_uuid=None, after=None):
+    """
+    Insurees of a location subtree or of a health facility in export order. Entries are
+    named after the insurance number, so the last complete entry of an interrupted export
+    is the `after` cursor to resume it from.
+    """
+    from membership.services import PDFGenerationService
+
+    insurees = PDFGenerationService.get_batch_insurees(
+        location_uuid=location_uuid, health_facility_uuid=health_facility_uuid
+    ).order_by("chf_id", "id")
+    if after:
+        insurees = insurees.filter(chf_id__gt=after)
+    return insurees
+
+
+def _render_card(user, card_data, template_name, queue_full_retries=5):
+    from membership.services import PDFGenerationService
+
+    for attempt in range(queue_full_retries + 1):
+        try:
+            card = PDFGenerationService.render_card(user, card_data, template_name)
+            break
+        except RenderQueueFull as e:
+            # Interactive requests go first, come back when the render pool has room
+            if attempt == queue_full_retries:
+                raise
+            time.sleep(e.retry_after)
+    with card.file:
+        return card.file.read()
+
+
+def iter_export_cards(user, insurees, template_name, workers=None, chunk_size=100, skip=()):
+    """
+    Yield (entry name, pdf content, error) for each insuree, in queryset order, while the next
+    cards render on `workers` threads. Card data is loaded chunk by chunk on the calling thread,
+    the workers only render, so they never hold a database connection.
+    Insurees whose entry name is in `skip` are left out.
+    """
+    from membership.services import PDFGenerationService
+
+    workers = workers or MembershipCardConfig.card_export_workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="membership-card-export") as executor:
+        for start in range(0, insurees.count(), chunk_size):
+            chunk = [
+                insuree for insuree in insurees[start:start + chunk_size]
+                if card_entry_name(insuree) not in skip
+            ]
+            for card_data in PDFGenerationService.load_batch_card_data(chunk):
+                pending.append((
+                    card_entry_name(card_data.insuree),
+                    executor.submit(_render_card, user, card_data, template_name),
+                ))
+                # Bounded look-ahead, rendered cards do not pile up in memory
+                while len(pending) > workers * 2:
+                    yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+
+def _result(entry_name, future):
+    try:
+        return entry_name, future.result(), None
+    except Exception as e:
+        logger.exception("Card %s could not be exported", entry_name)
+        return entry_name, None, e
+
+
+class _ZipBuffer:
+    """Write only file object zipfile streams into, drained after each entry."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def add_card_entry(archive, entry_name, content):
+    info = zipfile.ZipInfo(entry_name, date_time=datetime.now().timetuple()[:6])
+    # PDF streams are already compressed
+    archive.writestr(info, content, compress_type=zipfile.ZIP_STORED)
+
+
+def recover_zip(path):
+    """
+    Rewrite an archive left without central directory by a killed export, keeping the entries
+    written completely, in order. Entries are read from their local headers up to the first
+    missing, truncated or corrupt one. Returns the names of the entries kept.
+    """
+    recovered = []
+    tmp_path = f"{path}.recovering"
+    with open(path, "rb") as damaged, zipfile.ZipFile(tmp_path, mode="w") as archive:
+        while True:
+            header = damaged.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                break
+            (signature, _, _, flags, compression, _, _, crc,
+             compressed_size, _, name_length, extra_length) = LOCAL_HEADER.unpack(header)
+            # Sizes are only known up front for entries written to a seekable file, as exports are
+            if signature != LOCAL_HEADER_SIGNATURE or flags & DATA_DESCRIPTOR_FLAG:
+                break
+            name = damaged.read(name_length)
+            damaged.read(extra_length)
+            data = damaged.read(compressed_size)
+            if len(data) < compressed_size:
+                break
+            try:
+                if compression == zipfile.ZIP_DEFLATED:
+                    data = zlib.decompress(data, -zlib.MAX_WBITS)
+                elif compression != zipfile.ZIP_STORED:
+                    break
+            except zlib.error:
+                break
+            if zlib.crc32(data) != crc:
+                break
+            name = name.decode("utf-8" if flags & UTF8_NAME_FLAG else "cp437")
+            add_card_entry(archive, name, data)
+            recovered.append(name)
+    os.replace(tmp_path, path)
+    return recovered
+
+
+def write_card_entries(archive, cards):
+    """
+    Add the cards yielded by iter_export_cards to an open ZipFile, failed cards are listed
+    in an errors.txt entry at the end. Yields after each entry.
+    """
+    errors = []
+    for entry_name, content, error in cards:
+        if error is not None:
+            errors.append(f"{entry_name}: {error}")
+            continue
+        add_card_entry(archive, entry_name, content)
+        yield entry_name
+    if errors:
+        archive.writestr(ERRORS_ENTRY, "\n".join(errors) + "\n")
+        yield ERRORS_ENTRY
+
+
+def stream_card_zip(cards):
+    """Yield a ZIP archive of the cards piece by piece, nothing but the current card is held in memory."""
+    buffer = _ZipBuffer()
+    # An unseekable target makes zipfile use data descriptors instead of rewriting headers
+    with zipfile.ZipFile(buffer, mode="w") as archive:
+        for _ in write_card_entries(archive, cards):
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,183 @@
+# card_jobs.py
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from membership.apps import MembershipCardConfig
+from membership.utils.db_helper import get_db_helper
+from membership.utils.render_pool import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+
+class CardJobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class CardJobLimitReached(Exception):
+    """Raised when a user already has card_job_max_per_user jobs queued or running."""
+
+
+def current_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _process_alive(pid):
+    if os.name != "posix":
+        return True  # no way to probe a process without side effects, expired jobs are purged instead
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CardJobService:
+    """
+    Renders membership cards in the background of the serving process.
+
+    Jobs are recorded in the SQLite side database so that any server process can answer
+    status polls, the finished PDF is written to card_job_dir. No broker is involved:
+    jobs run on a small thread pool of the process that accepted them. Jobs record that
+    process, a restarted process fails the jobs its predecessors on the host left unfinished.
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+    _recovered_pid = None
+    queue_full_retries = 5
+    unfinished = (CardJobStatus.QUEUED, CardJobStatus.RUNNING)
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=MembershipCardConfig.card_job_workers,
+                    thread_name_prefix="membership-card-job",
+                )
+        return cls._executor
+
+    @classmethod
+    def submit(cls, user, insuree_uuid):
+        """Queue the rendering of an insuree card and return the job id right away."""
+        cls.recover_orphaned()
+        cls.purge_expired()
+        db_helper = get_db_helper(durable=True)  # the job id is polled right away
+        try:
+            if db_helper.count_card_jobs(str(user.id), cls.unfinished) >= MembershipCardConfig.card_job_max_per_user:
+                raise CardJobLimitReached("Too many card jobs in progress, wait for them to finish.")
+            job_id = uuid.uuid4().hex
+            db_helper.insert_card_job(job_id, insuree_uuid, str(user.id), CardJobStatus.QUEUED, current_worker())
+        finally:
+            db_helper.close()
+        cls._get_executor().submit(cls._run, job_id, user, insuree_uuid)
+        return job_id
+
+    @classmethod
+    def recover_orphaned(cls):
+        """
+        Once per process: fail the unfinished jobs of processes of this host that are gone, they
+        were lost with their thread pool. Jobs of other hosts are left to their own processes.
+        """
+        with cls._executor_lock:
+            if cls._recovered_pid == os.getpid():
+                return []
+            cls._recovered_pid = os.getpid()
+        host = socket.gethostname()
+        db_helper = get_db_helper()
+        try:
+            orphaned = []
+            for job_id, worker in db_helper.get_card_job_workers(cls.unfinished):
+                worker_host, _, pid = (worker or "").rpartition(":")
+                # Jobs from before workers were recorded can only be left over from before the upgrade
+                if worker is None or (worker_host == host and pid.isdigit() and not _process_alive(int(pid))):
+                    db_helper.update_card_job(job_id, CardJobStatus.FAILED, "Interrupted by a server restart")
+                    orphaned.append(job_id)
+        finally:
+            db_helper.close()
+        if orphaned:
+            logger.warning("Failed %s card jobs left unfinished by stopped server processes", len(orphaned))
+        return orphaned
+
+    @classmethod
+    def _run(cls, job_id, user, insuree_uuid):
+        from membership.services import PDFGenerationService
+
+        db_helper = get_db_helper()
+        try:
+            db_helper.update_card_job(job_id, CardJobStatus.RUNNING)
+            for attempt in range(cls.queue_full_retries + 1):
+                try:
+                    pdf_content = PDFGenerationService.generate_pdf_bytes(user, insuree_uuid)
+                    break
+                except RenderQueueFull as e:
+                    # Interactive requests go first, come back when the render pool has room
+                    if attempt == cls.queue_full_retries:
+                        raise
+                    time.sleep(e.retry_after)
+            cls._write_artifact(job_id, pdf_content)
+            db_helper.update_card_job(job_id, CardJobStatus.DONE)
+        except Exception as e:
+            logger.exception("Card job %s failed", job_id)
+            db_helper.update_card_job(job_id, CardJobStatus.FAILED, str(e))
+        finally:
+            db_helper.close()
+            close_old_connections()
+
+    @staticmethod
+    def artifact_path(job_id):
+        return os.path.join(MembershipCardConfig.card_job_dir, f"{job_id}.pdf")
+
+    @classmethod
+    def _write_artifact(cls, job_id, content):
+        os.makedirs(MembershipCardConfig.card_job_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MembershipCardConfig.card_job_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, cls.artifact_path(job_id))
+
+    @classmethod
+    def get_job(cls, job_id, user=None):
+        """Return the job as a dict, None if it does not exist or belongs to another user."""
+        cls.recover_orphaned()
+        db_helper = get_db_helper()
+        row = db_helper.get_card_job(job_id)
+        db_helper.close()
+        if not row:
+            return None
+        job_id, insuree_uuid, user_id, status, error, created_at, updated_at = row
+        if user is not None and user_id != str(user.id):
+            return None
+        return {
+            "job_id": job_id,
+            "insuree_uuid": insuree_uuid,
+            "status": status,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    @classmethod
+    def purge_expired(cls):
+        """Drop jobs, and their artifacts, older than card_job_ttl seconds."""
+        db_helper = get_db_helper()
+        job_ids = db_helper.delete_card_jobs_before(int(time.time()) - MembershipCardConfig.card_job_ttl)
+        db_helper.close()
+        for job_id in job_ids:
+            try:
+                os.remove(cls.artifact_path(job_id))
+            except FileNotFoundError:
+                pass
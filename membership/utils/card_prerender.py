@@ -0,0 +1,121 @@
+# card_prerender.py
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+from membership.apps import MembershipCardConfig
+from membership.utils.render_pool import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+
+class CardPrerenderQueue:
+    """
+    Debounced, coalesced queue of families whose cards are stale.
+
+    A family is queued once however often it changes: each change pushes its render `delay`
+    seconds further, up to `max_delay` seconds after the first change, so a family edited ten
+    times in a minute is rendered once, after the edits. A single background thread calls
+    `render(family_id)` for the families that are due.
+    """
+
+    def __init__(self, render, delay, max_delay=None):
+        self.render = render
+        self.delay = delay
+        self.max_delay = max_delay
+        self._due = {}  # family id -> (due at, first change at)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._rendered = 0
+        self._failed = 0
+
+    def schedule(self, family_id, delay=None):
+        if not family_id:
+            return
+        now = time.monotonic()
+        with self._condition:
+            first_change_at = self._due.get(family_id, (None, now))[1]
+            due_at = now + (self.delay if delay is None else delay)
+            if self.max_delay is not None:
+                due_at = min(due_at, first_change_at + self.max_delay)
+            self._due[family_id] = (due_at, first_change_at)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="membership-card-prerender", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._due)
+
+    def metrics(self):
+        with self._condition:
+            return {"pending": len(self._due), "rendered": self._rendered, "failed": self._failed}
+
+    def _take_due(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                family_ids = [family_id for family_id, (due_at, _) in self._due.items() if due_at <= now]
+                if family_ids:
+                    for family_id in family_ids:
+                        del self._due[family_id]
+                    return family_ids
+                timeout = min(due_at for due_at, _ in self._due.values()) - now if self._due else None
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            for family_id in self._take_due():
+                try:
+                    self.render(family_id)
+                    with self._condition:
+                        self._rendered += 1
+                except RenderQueueFull as e:
+                    # Interactive requests go first, come back when the render pool has room
+                    self.schedule(family_id, delay=e.retry_after)
+                except Exception:
+                    logger.exception("Cards of family %s could not be pre-rendered", family_id)
+                    with self._condition:
+                        self._failed += 1
+                finally:
+                    close_old_connections()
+
+
+def prerender_family_cards(family_id):
+    """Render the cards of the current members of a family into the card cache, hits are skipped."""
+    from insuree.models import Insuree
+    from membership.services import PDFGenerationService
+
+    template_name = MembershipCardConfig.get_template_by_os()
+    if not template_name:
+        return
+    insurees = list(
+        Insuree.objects.filter(family_id=family_id, validity_to=None, family__validity_to=None)
+        .select_related("family", "gender", "health_facility", "photo")
+        .order_by("id")
+    )
+    for card_data in PDFGenerationService.load_batch_card_data(insurees):
+        card = PDFGenerationService.render_card(None, card_data, template_name)
+        card.file.close()
+
+
+_card_prerender_queue = None
+_card_prerender_queue_lock = threading.Lock()
+
+
+def get_card_prerender_queue():
+    """Return the process wide pre-render queue, None when pre-rendering or the card cache is disabled."""
+    global _card_prerender_queue
+    if MembershipCardConfig.card_prerender_delay is None or not MembershipCardConfig.card_cache_backend:
+        return None
+    with _card_prerender_queue_lock:
+        if _card_prerender_queue is None:
+            _card_prerender_queue = CardPrerenderQueue(
+                prerender_family_cards,
+                delay=MembershipCardConfig.card_prerender_delay,
+                max_delay=MembershipCardConfig.card_prerender_max_delay,
+            )
+    return _card_prerender_queue
@@ -1,53 +1,363 @@
 # db_helper.py
+import atexit
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
 import time
 from pathlib import Path
 import json
 
+from membership.apps import DEFAULT_CFG, MembershipCardConfig
+
+logger = logging.getLogger(__name__)
+
 DB_PATH = "db.sqlite3"  # Path to SQLite database in root folder
 
-class SQLiteHelper:
+PRAGMAS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+
+def pragma_statements(pragmas):
+    """PRAGMA statements of a profile, names and values are checked as they come from configuration."""
+    statements = []
+    for name, value in (pragmas or {}).items():
+        if value is None:
+            continue
+        if name not in PRAGMAS:
+            raise ValueError(f"Unsupported side database PRAGMA {name!r}, expected one of {', '.join(PRAGMAS)}")
+        if not isinstance(value, int) and not re.fullmatch(r"[A-Za-z]+", str(value)):
+            raise ValueError(f"Invalid value {value!r} for PRAGMA {name}")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def create_tables(conn):
+    """Schema 1: the side tables, as created before the schema was versioned."""
+    query = """
+    CREATE TABLE IF NOT EXISTS membership_insuree (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        insuree_id INTEGER,  -- Foreign key to Insuree table (main DB)
+        phone TEXT UNIQUE,   -- Phone number (must be unique)
+        otp_code TEXT,       -- OTP code for validation
+        user_id INTEGER NULL,
+        otp_expiry INTEGER,  -- Unix timestamp for OTP expiration
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    payment_transactions_query = """
+    CREATE TABLE IF NOT EXISTS payment_transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        family_id INTEGER,      -- Foreign key to family table
+        paypal_transaction_id TEXT UNIQUE,  -- PayPal transaction ID
+        amount REAL,            -- Payment amount
+        status TEXT,            -- Payment status
+        validity_to TIMESTAMP NULL,  -- Validity date (initially NULL)
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    firebase_tokens_query = """
+    CREATE TABLE IF NOT EXISTS firebase_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,  -- Foreign key to User table
+        fcm_token TEXT UNIQUE,  -- Firebase Cloud Messaging token
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """                
+    card_jobs_query = """
+    CREATE TABLE IF NOT EXISTS card_jobs (
+        id TEXT PRIMARY KEY,     -- Job id handed out to the client
+        insuree_uuid TEXT,       -- Insuree whose card is rendered
+        user_id TEXT,            -- User who submitted the job
+        status TEXT,             -- queued, running, done or failed
+        error TEXT NULL,         -- Failure reason
+        created_at INTEGER,      -- Unix timestamp of submission
+        updated_at INTEGER       -- Unix timestamp of the last status change
+    );
+    """
+    conn.execute(query)
+    conn.execute(payment_transactions_query)
+    conn.execute(firebase_tokens_query)
+    conn.execute(card_jobs_query)
+
+
+def add_lookup_indexes(conn):
+    """Schema 2: logins, permission checks and FCM lookups filter on user_id, payments on family_id."""
+    conn.execute("CREATE INDEX IF NOT EXISTS membership_insuree_user_id ON membership_insuree (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS firebase_tokens_user_id ON firebase_tokens (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS payment_transactions_family_id ON payment_transactions (family_id)")
+
+
+def add_payment_json(conn):
+    """Schema 3: payment_transactions.payment_json, written by insert_payment_transaction."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(payment_transactions)")}
+    if "payment_json" not in columns:  # some databases had it added by hand
+        conn.execute("ALTER TABLE payment_transactions ADD COLUMN payment_json TEXT")
+
+
+def add_otp_attempts(conn):
+    """Schema 4: membership_insuree.otp_attempts, failed checks of the current OTP."""
+    conn.execute("ALTER TABLE membership_insuree ADD COLUMN otp_attempts INTEGER NOT NULL DEFAULT 0")
+
+
+def add_card_job_worker(conn):
+    """Schema 5: card_jobs.worker, the host and process id running a job, to fail the jobs of a dead process."""
+    conn.execute("ALTER TABLE card_jobs ADD COLUMN worker TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS card_jobs_status ON card_jobs (status)")
+
+
+# Schema changes in order, never edit or reorder them: append a new function instead.
+# The number of applied changes is recorded in the database as PRAGMA user_version.
+MIGRATIONS = [
+    create_tables,
+    add_lookup_indexes,
+    add_payment_json,
+    add_otp_attempts,
+    add_card_job_worker,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply the schema changes the database misses, each in its own transaction. Returns the schema version."""
+    version = schema_version(conn)
+    while version < len(MIGRATIONS):
+        # IMMEDIATE takes the write lock up front: processes starting together apply each change once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                version += 1
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
+
+
+class SQLiteConnections:
+    """
+    One reusable connection per thread to the side database, instead of one per SQLiteHelper.
+    The schema is migrated once per process, by ensure_schema() at startup or by the first
+    connection. Connections are tied to the process that opened them, a forked worker opens its own.
+    Each new connection applies the `pragmas` profile, see side_db_pragmas.
+    """
+
+    def __init__(self, db_path, pragmas=None):
+        self.db_path = db_path
+        self.pragma_statements = pragma_statements(pragmas)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn = self.connect()
+                try:
+                    migrate(conn)
+                finally:
+                    conn.close()
+                self._schema_ready = True
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            self.ensure_schema()
+            conn = self.connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def connect(self):
+        """A new connection with the PRAGMA profile applied, owned by the caller."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for statement in self.pragma_statements:
+            # journal_mode answers with a row, fetched so the statement runs to completion
+            conn.execute(statement).fetchall()
+        return conn
+
+    def release(self):
+        """Roll back what the current thread left uncommitted, its connection stays open for reuse."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid() and conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        """Close the connection of the current thread, e.g. before the thread ends."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            if self._local.pid == os.getpid():
+                conn.close()
+
+
+_connections = None
+_connections_lock = threading.Lock()
+
+
+def get_sqlite_connections():
+    """Return the process wide connection manager of the side database."""
+    global _connections
+    with _connections_lock:
+        if _connections is None or _connections.db_path != DB_PATH:
+            # A partial side_db_pragmas in the module configuration only overrides the PRAGMAs it sets
+            pragmas = {**DEFAULT_CFG["side_db_pragmas"], **MembershipCardConfig.side_db_pragmas}
+            _connections = SQLiteConnections(DB_PATH, pragmas)
+    return _connections
+
+
+class WriteAck:
+    """Acknowledgement of a queued write: wait() returns once it is committed, or raises its error."""
+
     def __init__(self):
-        """Initialize the SQLite database and create the table if not exists."""
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        self.create_table()
+        self._done = threading.Event()
+        self.error = None
 
-    def create_table(self):
-        """Create membership_insuree table if it doesn't exist."""
-        query = """
-        CREATE TABLE IF NOT EXISTS membership_insuree (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            insuree_id INTEGER,  -- Foreign key to Insuree table (main DB)
-            phone TEXT UNIQUE,   -- Phone number (must be unique)
-            otp_code TEXT,       -- OTP code for validation
-            user_id INTEGER NULL,
-            otp_expiry INTEGER,  -- Unix timestamp for OTP expiration
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("The side database write was not committed in time")
+        if self.error is not None:
+            raise self.error
+
+    def _set(self, error=None):
+        self.error = error
+        self._done.set()
+
+
+class SQLiteWriter:
+    """
+    Write-behind queue of the side database. A single thread owns the writes: it takes every
+    write queued while the previous transaction committed, up to `batch_size`, and commits
+    them in one transaction, so concurrent requests no longer fight over the database lock.
+    A failing batch is replayed write by write, one bad statement only fails its own WriteAck.
+    """
+
+    def __init__(self, connect, batch_size=100):
+        self._connect = connect
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+
+    def submit(self, query, params=()):
+        ack = WriteAck()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="membership-side-db-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((query, params, ack))
+        return ack
+
+    def flush(self, timeout=None):
+        """Wait until the writes queued so far are committed."""
+        self.submit(None).wait(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "batches": self._batches,
+                "writes": self._writes,
+                "failed": self._failed,
+            }
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for query, params, _ in batch:
+                if query is not None:
+                    conn.execute(query, params)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if len(batch) > 1:
+                for write in batch:
+                    self._commit(conn, [write])
+                return
+            logger.error("Side database write failed: %s", e)
+            with self._lock:
+                self._failed += 1
+            batch[0][2]._set(e)
+            return
+        with self._lock:
+            self._batches += 1
+            self._writes += sum(1 for query, _, _ in batch if query is not None)
+        for _, _, ack in batch:
+            ack._set()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_sqlite_writer():
+    """Return the writer thread of this process, None unless side_db_write_behind is set."""
+    global _writer, _writer_pid
+    if not MembershipCardConfig.side_db_write_behind:
+        return None
+    connections = get_sqlite_connections()
+    with _writer_lock:
+        # A forked worker starts its own writer, the parent's thread did not survive the fork
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = SQLiteWriter(connections.connect, batch_size=MembershipCardConfig.side_db_write_batch_size)
+            _writer_pid = os.getpid()
+            # Queued writes are committed before a normal interpreter exit
+            atexit.register(_writer.flush, MembershipCardConfig.side_db_write_timeout)
+    return _writer
+
+
+class SQLiteHelper:
+    def __init__(self, durable=False):
         """
-        payment_transactions_query = """
-        CREATE TABLE IF NOT EXISTS payment_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            family_id INTEGER,      -- Foreign key to family table
-            paypal_transaction_id TEXT UNIQUE,  -- PayPal transaction ID
-            amount REAL,            -- Payment amount
-            status TEXT,            -- Payment status
-            validity_to TIMESTAMP NULL,  -- Validity date (initially NULL)
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
+        Use the pooled connection of the current thread, the tables are created once per process.
+        With side_db_write_behind, writes are handed to the writer thread and return a WriteAck;
+        a `durable` helper waits for each of its writes to be committed, to read them back.
         """
-        firebase_tokens_query = """
-        CREATE TABLE IF NOT EXISTS firebase_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,  -- Foreign key to User table
-            fcm_token TEXT UNIQUE,  -- Firebase Cloud Messaging token
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """                
-        self.conn.execute(query)
-        self.conn.execute(payment_transactions_query)
-        self.conn.execute(firebase_tokens_query)
-        self.conn.commit()
+        self.conn = get_sqlite_connections().connection()
+        self.durable = durable
+        self.writer = get_sqlite_writer()
+
+    def _write(self, query, params):
+        if self.writer is None:
+            self.conn.execute(query, params)
+            self.conn.commit()
+            return None
+        ack = self.writer.submit(query, params)
+        if self.durable:
+            ack.wait(MembershipCardConfig.side_db_write_timeout)
+        return ack
+
+    def create_table(self):
+        """Bring the membership side tables up to the current schema version."""
+        migrate(self.conn)
 
     def insert_fcm_token(self, user_id, fcm_token):
         """Insert or replace the Firebase token for a user."""
@@ -55,8 +365,7 @@ class SQLiteHelper:
         INSERT OR REPLACE INTO firebase_tokens (user_id, fcm_token)
         VALUES (?, ?);
         """
-        self.conn.execute(query, (user_id, fcm_token))
-        self.conn.commit()
+        return self._write(query, (user_id, fcm_token))
 
     def get_fcm_token_by_user_id(self, user_id):
         """Retrieve Firebase token by user ID."""
@@ -65,28 +374,33 @@ class SQLiteHelper:
         result = cursor.fetchone()
         return result[0] if result else None  # Return token if found, else None
 
-    def insert_user(self, insuree_id, phone, otp_code):
+    def insert_user(self, insuree_id, phone, otp_code=None):
         """Insert or replace a user with OTP into the table."""
-        otp_expiry = int(time.time()) + 300  # OTP valid for 5 minutes
+        otp_expiry = int(time.time()) + MembershipCardConfig.otp_ttl
         query = """
         INSERT OR REPLACE INTO membership_insuree (insuree_id, phone, otp_code, otp_expiry)
         VALUES (?, ?, ?, ?);
         """
-        self.conn.execute(query, (insuree_id, phone, otp_code, otp_expiry))
-        self.conn.commit()
+        # Replacing a registration drops its user
+        previous_user_id = self._user_id_by_phone(phone)
+        if previous_user_id is None:
+            return self._write(query, (insuree_id, phone, otp_code, otp_expiry))
+        return self._write_identity(query, (insuree_id, phone, otp_code, otp_expiry), previous_user_id)
 
     def get_user_by_phone(self, phone):
         """Retrieve user by phone number."""
-        query = "SELECT * FROM membership_insuree WHERE phone = ?"
-        
+        query = """
+        SELECT id, insuree_id, phone, otp_code, user_id, otp_expiry, created_at
+        FROM membership_insuree WHERE phone = ?
+        """
         cursor = self.conn.execute(query, (phone,))
         return cursor.fetchone()
 
     def delete_user(self, phone):
         """Delete user by phone number."""
         query = "DELETE FROM membership_insuree WHERE phone = ?"
-        self.conn.execute(query, (phone,))
-        self.conn.commit()
+        previous_user_id = self._user_id_by_phone(phone)
+        return self._write_identity(query, (phone,), previous_user_id)
 
 
     def update_user_id_by_phone(self, phone, user_id):
@@ -96,8 +410,22 @@ class SQLiteHelper:
         SET user_id = ?
         WHERE phone = ?;
         """
-        self.conn.execute(query, (user_id, phone))
-        self.conn.commit()
+        previous_user_id = self._user_id_by_phone(phone)
+        return self._write_identity(query, (user_id, phone), previous_user_id, user_id)
+
+    def _user_id_by_phone(self, phone):
+        row = self.conn.execute("SELECT user_id FROM membership_insuree WHERE phone = ?", (phone,)).fetchone()
+        return row[0] if row else None
+
+    def _write_identity(self, query, params, *user_ids):
+        """A write changing which insuree users resolve to, their cached identities are dropped once committed."""
+        from membership.utils.identity import invalidate_insuree_identities
+
+        ack = self._write(query, params)
+        if ack is not None:
+            ack.wait(MembershipCardConfig.side_db_write_timeout)
+        invalidate_insuree_identities(*user_ids)
+        return ack
 
     def is_insuree(self, user_id):
         """Check if a user with the given user_id is in the membership_insuree table."""
@@ -117,8 +445,52 @@ class SQLiteHelper:
 
     def update_otp(self, user_id, new_otp):
         """Update the OTP for a specific user."""
-        self.conn.execute("UPDATE membership_insuree SET otp_code = ? WHERE id = ?", (new_otp, user_id))
+        return self._write("UPDATE membership_insuree SET otp_code = ? WHERE id = ?", (new_otp, user_id))
+
+    def set_otp(self, phone, otp_code, otp_expiry):
+        """Replace the OTP of a registration, its failed attempts start over."""
+        query = "UPDATE membership_insuree SET otp_code = ?, otp_expiry = ?, otp_attempts = 0 WHERE phone = ?"
+        return self._write(query, (otp_code, otp_expiry, phone))
+
+    def count_otp_attempt(self, phone, now):
+        """Count a check of the OTP of a registration, return the checks so far, None without a live OTP."""
+        # Written directly, not behind: the count is read back in the same transaction
+        cursor = self.conn.execute(
+            """
+            UPDATE membership_insuree SET otp_attempts = otp_attempts + 1
+            WHERE phone = ? AND otp_code IS NOT NULL AND otp_expiry >= ?
+            """,
+            (phone, now),
+        )
+        attempts = None
+        if cursor.rowcount:
+            attempts = self.conn.execute(
+                "SELECT otp_attempts FROM membership_insuree WHERE phone = ?", (phone,)
+            ).fetchone()[0]
         self.conn.commit()
+        return attempts
+
+    def consume_otp(self, phone, otp_code, now):
+        """Use up the OTP of a registration if it matches and is live, True for the one caller that did."""
+        cursor = self.conn.execute(
+            "UPDATE membership_insuree SET otp_code = NULL WHERE phone = ? AND otp_code = ? AND otp_expiry >= ?",
+            (phone, otp_code, now),
+        )
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def clear_otp(self, phone):
+        """Drop the OTP of a registration."""
+        self.conn.execute("UPDATE membership_insuree SET otp_code = NULL WHERE phone = ?", (phone,))
+        self.conn.commit()
+
+    def delete_pending_users_before(self, timestamp):
+        """Delete registrations never validated whose OTP expired before the given unix timestamp, return how many."""
+        cursor = self.conn.execute(
+            "DELETE FROM membership_insuree WHERE user_id IS NULL AND otp_expiry < ?", (timestamp,)
+        )
+        self.conn.commit()
+        return cursor.rowcount
 
 
     def insert_payment_transaction(self, family_id, paypal_transaction_id, payment_json):
@@ -127,8 +499,7 @@ class SQLiteHelper:
         INSERT INTO payment_transactions (family_id, paypal_transaction_id, payment_json)
         VALUES (?, ?, ?);
         """
-        self.conn.execute(query, (family_id, paypal_transaction_id, json.dumps(payment_json)))
-        self.conn.commit()
+        return self._write(query, (family_id, paypal_transaction_id, json.dumps(payment_json)))
 
 
     def update_validity_to(self, transaction_id, validity_date):
@@ -138,8 +509,7 @@ class SQLiteHelper:
         SET validity_to = ?
         WHERE id = ?;
         """
-        self.conn.execute(query, (validity_date, transaction_id))
-        self.conn.commit()
+        return self._write(query, (validity_date, transaction_id))
 
     def get_payment_by_transaction_id(self, paypal_transaction_id):
         """Retrieve payment transaction by PayPal transaction ID."""
@@ -149,6 +519,70 @@ class SQLiteHelper:
         cursor = self.conn.execute(query, (paypal_transaction_id,))
         return cursor.fetchone()
 
+    def insert_card_job(self, job_id, insuree_uuid, user_id, status, worker=None):
+        """Insert a new card generation job."""
+        now = int(time.time())
+        query = """
+        INSERT INTO card_jobs (id, insuree_uuid, user_id, status, created_at, updated_at, worker)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
+        """
+        return self._write(query, (job_id, insuree_uuid, user_id, status, now, now, worker))
+
+    def count_card_jobs(self, user_id, statuses):
+        """Number of card generation jobs of a user in one of the given statuses."""
+        placeholders = ", ".join("?" * len(statuses))
+        query = f"SELECT COUNT(*) FROM card_jobs WHERE user_id = ? AND status IN ({placeholders})"
+        return self.conn.execute(query, (user_id, *statuses)).fetchone()[0]
+
+    def get_card_job_workers(self, statuses):
+        """(job id, worker) of the card generation jobs in one of the given statuses."""
+        placeholders = ", ".join("?" * len(statuses))
+        query = f"SELECT id, worker FROM card_jobs WHERE status IN ({placeholders})"
+        return self.conn.execute(query, tuple(statuses)).fetchall()
+
+    def update_card_job(self, job_id, status, error=None):
+        """Update the status of a card generation job."""
+        query = "UPDATE card_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?"
+        return self._write(query, (status, error, int(time.time()), job_id))
+
+    def get_card_job(self, job_id):
+        """Retrieve a card generation job by id."""
+        query = """
+        SELECT id, insuree_uuid, user_id, status, error, created_at, updated_at
+        FROM card_jobs WHERE id = ?
+        """
+        cursor = self.conn.execute(query, (job_id,))
+        return cursor.fetchone()
+
+    def delete_card_jobs_before(self, timestamp):
+        """Delete card generation jobs created before the given unix timestamp, return their ids."""
+        cursor = self.conn.execute("SELECT id FROM card_jobs WHERE created_at < ?", (timestamp,))
+        job_ids = [row[0] for row in cursor.fetchall()]
+        self.conn.execute("DELETE FROM card_jobs WHERE created_at < ?", (timestamp,))
+        self.conn.commit()
+        return job_ids
+
+    def checkpoint(self, mode="PASSIVE"):
+        """Copy the write-ahead log back into the database file, return (busy, log pages, checkpointed pages)."""
+        mode = mode.upper()
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Invalid checkpoint mode {mode!r}, expected one of {', '.join(CHECKPOINT_MODES)}")
+        return self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def journal_mode(self):
+        return self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+
     def close(self):
-        """Close the database connection."""
-        self.conn.close()
+        """Release the connection, it stays open for the next SQLiteHelper of this thread."""
+        get_sqlite_connections().release()
+
+
+def get_db_helper(durable=False):
+    """
+    SQLiteHelper, or its ORM counterpart over the main database when side_db_backend is "orm".
+    `durable` helpers return from writes once committed, ORM writes always are.
+    """
+    if MembershipCardConfig.side_db_backend == "orm":
+        from membership.utils.orm_helper import ORMHelper
+        return ORMHelper()
+    return SQLiteHelper(durable=durable)
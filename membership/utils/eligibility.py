@@ -0,0 +1,70 @@
+# eligibility.py
+from datetime import date, datetime
+
+FULL_YEAR_MASK = (1 << 12) - 1
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or touching (start, end) date intervals, empty ones are dropped."""
+    merged = []
+    for start, end in sorted(interval for interval in intervals if interval[0] <= interval[1]):
+        if merged and start.toordinal() <= merged[-1][1].toordinal() + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def month_mask(intervals, year):
+    """
+    12-bit mask of the months of `year` touched by the intervals, bit 0 being January.
+    A month counts as covered as soon as one of its days is.
+    """
+    mask = 0
+    for start, end in intervals:
+        if start.year > year or end.year < year:
+            continue
+        first_month = start.month if start.year == year else 1
+        last_month = end.month if end.year == year else 12
+        mask |= ((1 << (last_month - first_month + 1)) - 1) << (first_month - 1)
+        if mask == FULL_YEAR_MASK:
+            break
+    return mask
+
+
+def is_month_covered(mask, month):
+    return bool(mask >> (month - 1) & 1)
+
+
+class EligibilityCalendar:
+    """
+    Covered months of an insuree, computed from its InsureePolicy validity windows.
+
+    The policy intervals are merged once, open-ended policies run until `today`,
+    and any number of years can then be asked for without touching the database again.
+    """
+
+    def __init__(self, insuree_policies, today=None):
+        today = today or date.today()
+        self.intervals = merge_intervals(
+            (
+                _as_date(policy.validity_from),
+                _as_date(policy.validity_to) if policy.validity_to else today,
+            )
+            for policy in insuree_policies
+            if policy.validity_from
+        )
+        self._masks = {}
+
+    def month_mask(self, year):
+        if year not in self._masks:
+            self._masks[year] = month_mask(self.intervals, year)
+        return self._masks[year]
+
+    def masks(self, years):
+        return {year: self.month_mask(year) for year in years}
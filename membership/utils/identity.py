@@ -0,0 +1,118 @@
+# identity.py
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from membership.apps import MembershipCardConfig
+
+InsureeIdentity = namedtuple("InsureeIdentity", ["insuree_id", "family_id", "chf_id"])
+
+_MISSING = object()
+
+
+class IdentityResolver:
+    """
+    Resolves the interactive user id (i_user_id) of an insuree's account to its InsureeIdentity,
+    None for users who are not insurees. Resolutions are kept in a process local LRU for
+    `local_ttl` seconds, in front of the Django cache `cache_alias` shared by the processes.
+    Registration changes invalidate both, the local LRUs of other processes expire on their own.
+    """
+
+    def __init__(self, cache_alias=None, timeout=300, local_size=10000, local_ttl=30):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local = OrderedDict()  # user id -> (expires at, identity)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(user_id):
+        return f"membership:identity:{user_id}"
+
+    def _cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def resolve(self, user_id):
+        if user_id is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(user_id)
+                return entry[1]
+        cache = self._cache()
+        identity = cache.get(self.cache_key(user_id), _MISSING) if cache is not None else _MISSING
+        if identity is _MISSING:
+            identity = self.load(user_id)
+            if cache is not None:
+                cache.set(self.cache_key(user_id), identity, self.timeout)
+        elif identity is not None:
+            identity = InsureeIdentity(*identity)
+        self._remember(user_id, identity, now)
+        return identity
+
+    @staticmethod
+    def load(user_id):
+        from insuree.models import Insuree
+        from membership.utils.db_helper import get_db_helper
+
+        db_helper = get_db_helper()
+        try:
+            insuree_id = db_helper.get_insuree_id_by_user_id(user_id)
+        finally:
+            db_helper.close()
+        if insuree_id is None:
+            return None
+        row = Insuree.objects.filter(id=insuree_id).values_list("family_id", "chf_id").first()
+        if row is None:
+            return None
+        return InsureeIdentity(insuree_id, *row)
+
+    def _remember(self, user_id, identity, now):
+        with self._lock:
+            self._local[user_id] = (now + self.local_ttl, identity)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return
+        with self._lock:
+            for user_id in user_ids:
+                self._local.pop(user_id, None)
+        cache = self._cache()
+        if cache is not None:
+            cache.delete_many([self.cache_key(user_id) for user_id in user_ids])
+
+
+_identity_resolver = None
+_identity_resolver_lock = threading.Lock()
+
+
+def get_identity_resolver():
+    """Return the process wide identity resolver, configured from MembershipCardConfig."""
+    global _identity_resolver
+    with _identity_resolver_lock:
+        if _identity_resolver is None:
+            _identity_resolver = IdentityResolver(
+                cache_alias=MembershipCardConfig.identity_cache_alias,
+                timeout=MembershipCardConfig.identity_cache_timeout,
+                local_size=MembershipCardConfig.identity_local_cache_size,
+                local_ttl=MembershipCardConfig.identity_local_cache_ttl,
+            )
+    return _identity_resolver
+
+
+def resolve_insuree_identity(user_id):
+    return get_identity_resolver().resolve(user_id)
+
+
+def invalidate_insuree_identities(*user_ids):
+    get_identity_resolver().invalidate(*user_ids)
@@ -0,0 +1,130 @@
+# imposition.py
+from collections import namedtuple
+
+
+def _mm(value):
+    # Preformatted: Django would localize floats, "12,5mm" is not CSS
+    return f"{value:.2f}"
+
+
+class SheetLayout(namedtuple("SheetLayout", [
+    "rows", "cols", "sheet_width", "sheet_height", "margin", "gutter",
+    "card_width", "card_height", "crop_mark_length", "crop_mark_offset",
+])):
+    """
+    Grid of rows x cols cards on a sheet, all sizes in millimeters. Cards are designed for a
+    card_width x card_height page and scaled down to fit their cell, keeping their proportions.
+    """
+
+    @classmethod
+    def from_config(cls, config, rows=None, cols=None):
+        values = dict(config)
+        if rows:
+            values["rows"] = rows
+        if cols:
+            values["cols"] = cols
+        layout = cls(**values)
+        if layout.rows < 1 or layout.cols < 1:
+            raise ValueError("An imposition grid needs at least one row and one column")
+        if layout.cell_width <= 0 or layout.cell_height <= 0:
+            raise ValueError("The imposition margins and gutters leave no room for the cards")
+        return layout
+
+    @property
+    def per_sheet(self):
+        return self.rows * self.cols
+
+    @property
+    def cell_width(self):
+        return (self.sheet_width - 2 * self.margin - (self.cols - 1) * self.gutter) / self.cols
+
+    @property
+    def cell_height(self):
+        return (self.sheet_height - 2 * self.margin - (self.rows - 1) * self.gutter) / self.rows
+
+    @property
+    def scale(self):
+        return min(self.cell_width / self.card_width, self.cell_height / self.card_height)
+
+    def cell_origins(self):
+        """Top left corner of each cell, row by row."""
+        return [
+            (
+                self.margin + col * (self.cell_width + self.gutter),
+                self.margin + row * (self.cell_height + self.gutter),
+            )
+            for row in range(self.rows)
+            for col in range(self.cols)
+        ]
+
+    def crop_marks(self):
+        """
+        Thin lines outside each cell corner along the cut lines, as (x, y, width, height).
+        Marks start crop_mark_offset away from the cell and never reach a neighbour cell.
+        """
+        offset, weight = self.crop_mark_offset, 0.2
+        marks = []
+        for index, (x, y) in enumerate(self.cell_origins()):
+            row, col = divmod(index, self.cols)
+            right, bottom = x + self.cell_width, y + self.cell_height
+            # Room for a mark on each side: the margin on the outside, half the gutter between cells
+            room_left = self.margin if col == 0 else self.gutter / 2
+            room_right = self.margin if col == self.cols - 1 else self.gutter / 2
+            room_top = self.margin if row == 0 else self.gutter / 2
+            room_bottom = self.margin if row == self.rows - 1 else self.gutter / 2
+            for corner_y in (y, bottom):
+                length = min(self.crop_mark_length, room_left - offset)
+                if length > 0:
+                    marks.append((x - offset - length, corner_y - weight / 2, length, weight))
+                length = min(self.crop_mark_length, room_right - offset)
+                if length > 0:
+                    marks.append((right + offset, corner_y - weight / 2, length, weight))
+            for corner_x in (x, right):
+                length = min(self.crop_mark_length, room_top - offset)
+                if length > 0:
+                    marks.append((corner_x - weight / 2, y - offset - length, weight, length))
+                length = min(self.crop_mark_length, room_bottom - offset)
+                if length > 0:
+                    marks.append((corner_x - weight / 2, bottom + offset, weight, length))
+        return marks
+
+    def sheets(self, cards):
+        """Cards grouped per sheet, each with the position of its cell."""
+        origins = self.cell_origins()
+        return [
+            [
+                {"card": card, "x": _mm(origins[i][0]), "y": _mm(origins[i][1])}
+                for i, card in enumerate(cards[start:start + self.per_sheet])
+            ]
+            for start in range(0, len(cards), self.per_sheet)
+        ]
+
+    def context(self, cards):
+        return {
+            "sheets": self.sheets(cards),
+            "crop_marks": [
+                {"x": _mm(x), "y": _mm(y), "width": _mm(width), "height": _mm(height)}
+                for x, y, width, height in self.crop_marks()
+            ],
+            "sheet_width": _mm(self.sheet_width),
+            "sheet_height": _mm(self.sheet_height),
+            "cell_width": _mm(self.cell_width),
+            "cell_height": _mm(self.cell_height),
+            "card_width": _mm(self.card_width),
+            "scale": f"{self.scale:.4f}",
+        }
+
+
+def parse_grid(value):
+    """Parse a "3x2" grid into (3, 2), rows first."""
+    try:
+        rows, cols = (int(part) for part in value.lower().split("x"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid imposition grid {value!r}, expected <rows>x<cols> such as 2x2")
+    return rows, cols
+
+
+def card_partials(template_name):
+    """Styles and page templates of a card template, card_template_<os>.html by convention."""
+    suffix = template_name.replace("card_template_", "", 1)
+    return f"card_styles_{suffix}", f"card_page_{suffix}"
@@ -0,0 +1,57 @@
+# insuree_claims.py
+import jwt
+
+from membership.apps import MembershipCardConfig
+from membership.utils.identity import InsureeIdentity, resolve_insuree_identity
+
+CLAIMS = ("insuree_id", "family_id", "chf_id")
+
+
+def add_insuree_claims(payload, user):
+    """
+    Add the insuree of `user` to a token payload before it is signed: is_insuree, and for
+    insurees insuree_id, family_id and chf_id. Claims hold for the token's lifetime, a
+    registration removed meanwhile is only noticed once the token expires.
+    """
+    if not MembershipCardConfig.jwt_insuree_claims:
+        return payload
+    identity = resolve_insuree_identity(user.i_user_id)
+    payload["is_insuree"] = identity is not None
+    if identity is not None:
+        payload.update(identity._asdict())
+    return payload
+
+
+def token_insuree_claims(request):
+    """
+    Claims of the token a request was authenticated with, None when it was authenticated otherwise
+    or its token has no insuree claims. The authentication class verified the token already, it is
+    decoded again without verifying the signature, to read its payload only.
+    """
+    from core.jwt_authentication import JWTAuthentication
+    from graphql_jwt.utils import get_credentials
+
+    if not MembershipCardConfig.jwt_insuree_claims:
+        return None
+    if not isinstance(getattr(request, "successful_authenticator", None), JWTAuthentication):
+        return None
+    token = get_credentials(request)
+    if not token:
+        return None
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return None
+    if "is_insuree" not in claims or claims.get("username") != request.user.username:
+        return None
+    return claims
+
+
+def request_insuree_identity(request):
+    """InsureeIdentity of the authenticated user of a request, None if not an insuree."""
+    claims = token_insuree_claims(request)
+    if claims is None:
+        return resolve_insuree_identity(request.user.i_user_id)
+    if not claims["is_insuree"]:
+        return None
+    return InsureeIdentity(*(claims.get(claim) for claim in CLAIMS))
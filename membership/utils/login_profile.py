@@ -0,0 +1,79 @@
+# login_profile.py
+from membership.apps import MembershipCardConfig
+from membership.utils.identity import resolve_insuree_identity
+
+# Users that are not insurees are cached with this insuree id
+NO_INSUREE = 0
+
+
+def cache_key(username):
+    return f"membership:login_profile:{username}"
+
+
+def _profile_cache():
+    if not MembershipCardConfig.login_profile_cache_timeout or not MembershipCardConfig.identity_cache_alias:
+        return None
+    from django.core.cache import caches
+    return caches[MembershipCardConfig.identity_cache_alias]
+
+
+def load_login_profile(username):
+    """
+    Signin's response fields besides the token, None for an unknown username. Takes one query
+    for the user joined to its interactive, officer and claim administrator rows, the cached
+    insuree identity and one query for the insuree, when the user is one.
+    """
+    cache = _profile_cache()
+    if cache is not None:
+        cached = cache.get(cache_key(username))
+        if cached is not None:
+            # Registration changes invalidate identities, not profiles: a cached profile is only
+            # used while it was built for the insuree the user currently resolves to
+            i_user_id, insuree_id, profile = cached
+            identity = resolve_insuree_identity(i_user_id)
+            if (identity.insuree_id if identity else NO_INSUREE) == insuree_id:
+                return profile
+    loaded = _load(username)
+    if loaded is None:
+        return None
+    if cache is not None:
+        cache.set(cache_key(username), loaded, MembershipCardConfig.login_profile_cache_timeout)
+    return loaded[2]
+
+
+def _load(username):
+    from core.models import User
+    from insuree.models import Insuree
+
+    user = (
+        User.objects.filter(username=username)
+        .select_related("i_user", "officer", "claim_admin", "t_user")
+        .first()
+    )
+    if user is None:
+        return None
+    identity = resolve_insuree_identity(user.i_user_id)
+    insuree_info = {}
+    if identity is not None:
+        insuree = (
+            Insuree.objects.filter(id=identity.insuree_id)
+            .values("other_names", "last_name", "chf_id", "uuid", "family_id")
+            .first()
+        )
+        if insuree:
+            insuree_info = {
+                "first_name": insuree["other_names"],
+                "last_name": insuree["last_name"],
+                "chfid": insuree["chf_id"],
+                "uuid": insuree["uuid"],
+                "family": insuree["family_id"],
+            }
+    u = user._u
+    profile = {
+        "first_name": getattr(u, "other_names", "") or "" if u else "",
+        "last_name": getattr(u, "last_name", "") or "" if u else "",
+        "email": getattr(u, "email", "") or "" if u else "",
+        "is_insuree": identity is not None,
+        "insuree_info": insuree_info,
+    }
+    return user.i_user_id, identity.insuree_id if identity else NO_INSUREE, profile
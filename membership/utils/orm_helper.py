@@ -0,0 +1,180 @@
+# orm_helper.py
+import json
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from membership.apps import MembershipCardConfig
+from membership.models import CardJob, FirebaseToken, MembershipInsuree, PaymentTransaction
+from membership.utils.identity import invalidate_insuree_identities
+
+# Column order of the rows SQLiteHelper returns, callers unpack them
+MEMBERSHIP_INSUREE_ROW = ("id", "insuree_id", "phone", "otp_code", "user_id", "otp_expiry", "created_at")
+PAYMENT_TRANSACTION_ROW = (
+    "id", "family_id", "paypal_transaction_id", "amount", "status", "validity_to", "created_at", "payment_json",
+)
+CARD_JOB_ROW = ("id", "insuree_uuid", "user_id", "status", "error", "created_at", "updated_at")
+
+
+class ORMHelper:
+    """
+    SQLiteHelper's methods over the membership models of the main database, returning the same
+    values and row tuples. Writes join the transaction of the request, if any.
+    """
+
+    def create_table(self):
+        """The tables are created by the membership migrations."""
+
+    def insert_fcm_token(self, user_id, fcm_token):
+        """Insert or replace the Firebase token for a user."""
+        FirebaseToken.objects.update_or_create(
+            fcm_token=fcm_token, defaults={"user_id": user_id, "created_at": timezone.now()}
+        )
+
+    def get_fcm_token_by_user_id(self, user_id):
+        """Retrieve Firebase token by user ID."""
+        return FirebaseToken.objects.filter(user_id=user_id).order_by("id").values_list("fcm_token", flat=True).first()
+
+    def insert_user(self, insuree_id, phone, otp_code=None):
+        """Insert or replace a user with OTP, a replaced registration loses its user like in SQLite."""
+        previous_user_id = self._user_id_by_phone(phone)
+        MembershipInsuree.objects.update_or_create(
+            phone=phone,
+            defaults={
+                "insuree_id": insuree_id,
+                "otp_code": otp_code,
+                "otp_expiry": int(time.time()) + MembershipCardConfig.otp_ttl,
+                "otp_attempts": 0,
+                "user_id": None,
+                "created_at": timezone.now(),
+            },
+        )
+        self._invalidate(previous_user_id)
+
+    def get_user_by_phone(self, phone):
+        """Retrieve user by phone number."""
+        return MembershipInsuree.objects.filter(phone=phone).values_list(*MEMBERSHIP_INSUREE_ROW).first()
+
+    def delete_user(self, phone):
+        """Delete user by phone number."""
+        previous_user_id = self._user_id_by_phone(phone)
+        MembershipInsuree.objects.filter(phone=phone).delete()
+        self._invalidate(previous_user_id)
+
+    def update_user_id_by_phone(self, phone, user_id):
+        """Update the user_id for the given phone number."""
+        previous_user_id = self._user_id_by_phone(phone)
+        MembershipInsuree.objects.filter(phone=phone).update(user_id=user_id)
+        self._invalidate(previous_user_id, user_id)
+
+    @staticmethod
+    def _user_id_by_phone(phone):
+        return MembershipInsuree.objects.filter(phone=phone).values_list("user_id", flat=True).first()
+
+    @staticmethod
+    def _invalidate(*user_ids):
+        # Dropped once committed, a resolution in between would cache the old identity again
+        transaction.on_commit(lambda: invalidate_insuree_identities(*user_ids))
+
+    def is_insuree(self, user_id):
+        """Check if a user with the given user_id is a registered insuree."""
+        return MembershipInsuree.objects.filter(user_id=user_id).exists()
+
+    def get_insuree_id_by_user_id(self, user_id):
+        """Retrieve the insuree_id of the registration of a user."""
+        return (
+            MembershipInsuree.objects.filter(user_id=user_id)
+            .order_by("id")
+            .values_list("insuree_id", flat=True)
+            .first()
+        )
+
+    def update_otp(self, user_id, new_otp):
+        """Update the OTP of a registration, by its id."""
+        MembershipInsuree.objects.filter(id=user_id).update(otp_code=new_otp)
+
+    def set_otp(self, phone, otp_code, otp_expiry):
+        """Replace the OTP of a registration, its failed attempts start over."""
+        MembershipInsuree.objects.filter(phone=phone).update(otp_code=otp_code, otp_expiry=otp_expiry, otp_attempts=0)
+
+    def count_otp_attempt(self, phone, now):
+        """Count a check of the OTP of a registration, return the checks so far, None without a live OTP."""
+        with transaction.atomic():
+            counted = MembershipInsuree.objects.filter(
+                phone=phone, otp_code__isnull=False, otp_expiry__gte=now
+            ).update(otp_attempts=F("otp_attempts") + 1)
+            if not counted:
+                return None
+            return MembershipInsuree.objects.filter(phone=phone).values_list("otp_attempts", flat=True).first()
+
+    def consume_otp(self, phone, otp_code, now):
+        """Use up the OTP of a registration if it matches and is live, True for the one caller that did."""
+        return MembershipInsuree.objects.filter(
+            phone=phone, otp_code=otp_code, otp_expiry__gte=now
+        ).update(otp_code=None) == 1
+
+    def clear_otp(self, phone):
+        """Drop the OTP of a registration."""
+        MembershipInsuree.objects.filter(phone=phone).update(otp_code=None)
+
+    def delete_pending_users_before(self, timestamp):
+        """Delete registrations never validated whose OTP expired before the given unix timestamp, return how many."""
+        return MembershipInsuree.objects.filter(user_id__isnull=True, otp_expiry__lt=timestamp).delete()[0]
+
+    def insert_payment_transaction(self, family_id, paypal_transaction_id, payment_json):
+        """Insert a new payment transaction with full JSON."""
+        PaymentTransaction.objects.create(
+            family_id=family_id, paypal_transaction_id=paypal_transaction_id, payment_json=payment_json
+        )
+
+    def update_validity_to(self, transaction_id, validity_date):
+        """Update the validity_to column for a specific transaction."""
+        PaymentTransaction.objects.filter(id=transaction_id).update(validity_to=validity_date)
+
+    def get_payment_by_transaction_id(self, paypal_transaction_id):
+        """Retrieve payment transaction by PayPal transaction ID."""
+        row = (
+            PaymentTransaction.objects.filter(paypal_transaction_id=paypal_transaction_id)
+            .values_list(*PAYMENT_TRANSACTION_ROW)
+            .first()
+        )
+        if row is None:
+            return None
+        # SQLite returns the JSON text as stored
+        return row[:-1] + (json.dumps(row[-1]) if row[-1] is not None else None,)
+
+    def insert_card_job(self, job_id, insuree_uuid, user_id, status, worker=None):
+        """Insert a new card generation job."""
+        now = int(time.time())
+        CardJob.objects.create(
+            id=job_id, insuree_uuid=insuree_uuid, user_id=user_id, status=status, created_at=now, updated_at=now,
+            worker=worker,
+        )
+
+    def count_card_jobs(self, user_id, statuses):
+        """Number of card generation jobs of a user in one of the given statuses."""
+        return CardJob.objects.filter(user_id=user_id, status__in=statuses).count()
+
+    def get_card_job_workers(self, statuses):
+        """(job id, worker) of the card generation jobs in one of the given statuses."""
+        return list(CardJob.objects.filter(status__in=statuses).values_list("id", "worker"))
+
+    def update_card_job(self, job_id, status, error=None):
+        """Update the status of a card generation job."""
+        CardJob.objects.filter(id=job_id).update(status=status, error=error, updated_at=int(time.time()))
+
+    def get_card_job(self, job_id):
+        """Retrieve a card generation job by id."""
+        return CardJob.objects.filter(id=job_id).values_list(*CARD_JOB_ROW).first()
+
+    def delete_card_jobs_before(self, timestamp):
+        """Delete card generation jobs created before the given unix timestamp, return their ids."""
+        jobs = CardJob.objects.filter(created_at__lt=timestamp)
+        job_ids = list(jobs.values_list("id", flat=True))
+        jobs.filter(id__in=job_ids).delete()
+        return job_ids
+
+    def close(self):
+        """Nothing to release, the main database connection is managed by Django."""
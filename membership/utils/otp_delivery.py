@@ -0,0 +1,280 @@
+# otp_delivery.py
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+
+from membership.apps import MembershipCardConfig
+
+logger = logging.getLogger(__name__)
+
+OTPMessage = namedtuple("OTPMessage", ["otp", "phone", "email"])
+
+
+def otp_text(message):
+    return f"Your OTP code is: {message.otp}, do not share it with anyone"
+
+
+class OTPTransport:
+    """Sends OTP messages through one channel. Messages the channel cannot reach are skipped."""
+
+    def accepts(self, message):
+        return True
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """Send messages taken from the queue together, return those that failed with their error."""
+        failed = []
+        for message in messages:
+            try:
+                self.send(message)
+            except Exception as e:
+                failed.append((message, e))
+        return failed
+
+
+class ConsoleTransport(OTPTransport):
+    """Logs the OTPs, for development only: anyone reading the logs can register."""
+
+    def send(self, message):
+        logger.warning("OTP for %s: %s", message.phone or message.email, message.otp)
+
+
+class FileTransport(OTPTransport):
+    """Appends the messages as JSON lines to `path`, standing in for a provider in tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        self.send_batch([message])
+
+    def send_batch(self, messages):
+        lines = "".join(json.dumps({**message._asdict(), "text": otp_text(message)}) + "\n" for message in messages)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return []
+
+
+class HTTPTransport(OTPTransport):
+    """
+    JSON API of a provider, one pooled requests.Session per worker thread so connections to the
+    provider are reused across messages. Requests are bounded by `timeout` seconds.
+    """
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            session.headers["Content-Type"] = "application/json"
+            if self.token:
+                session.headers["Authorization"] = f"Bearer {self.token}"
+            self._local.session = session
+        return session
+
+    def payload(self, message):
+        raise NotImplementedError
+
+    def send(self, message):
+        response = self.session().post(self.url, json=self.payload(message), timeout=self.timeout)
+        response.raise_for_status()
+
+
+class EmailTransport(HTTPTransport):
+    """Email send API taking Mailtrap's payload: from, to, subject and text."""
+
+    def __init__(self, url, token=None, sender="hello@openimis.org", timeout=10):
+        super().__init__(url, token, timeout)
+        self.sender = sender
+
+    def accepts(self, message):
+        return bool(message.email)
+
+    def payload(self, message):
+        return {
+            "from": {"email": self.sender, "name": "openIMIS"},
+            "to": [{"email": message.email}],
+            "subject": "Your openIMIS OTP code",
+            "text": otp_text(message),
+        }
+
+
+class SMSTransport(HTTPTransport):
+    """SMS gateway taking a JSON body of from, to and text."""
+
+    def __init__(self, url, token=None, sender=None, timeout=10):
+        super().__init__(url, token, timeout)
+        self.sender = sender
+
+    def accepts(self, message):
+        return bool(message.phone)
+
+    def payload(self, message):
+        return {"from": self.sender, "to": message.phone, "text": otp_text(message)}
+
+
+class OTPDeliveryQueueFull(Exception):
+    pass
+
+
+class OTPDelivery:
+    """
+    Delivers OTP messages in the background, so a registration does not wait on the provider.
+    `workers` threads take up to `batch_size` queued messages at a time and hand them to each
+    transport accepting them. A failed message is tried again `retries` times, after
+    `backoff` seconds doubled at each try, with full jitter so retries to a provider that is
+    down do not come back in lockstep.
+    """
+
+    def __init__(self, transports, workers=2, queue_size=1000, batch_size=20, retries=3, backoff=1.0):
+        self.transports = transports
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+
+    def submit(self, message):
+        with self._lock:
+            if not self._threads:
+                for index in range(self.workers):
+                    thread = threading.Thread(target=self._run, name=f"membership-otp-delivery-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            raise OTPDeliveryQueueFull("Too many OTPs waiting for delivery")
+
+    def flush(self):
+        """Wait until the messages queued so far are delivered or given up on."""
+        self._queue.join()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "sent": self._sent,
+                "retried": self._retried,
+                "failed": self._failed,
+            }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(batch)
+            except Exception:
+                logger.exception("OTP delivery failed")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch):
+        for transport in self.transports:
+            messages = [message for message in batch if transport.accepts(message)]
+            if not messages:
+                continue
+            failed = transport.send_batch(messages)
+            with self._lock:
+                self._sent += len(messages) - len(failed)
+            for message, error in failed:
+                self._retry(transport, message, error)
+
+    def _retry(self, transport, message, error):
+        for attempt in range(self.retries):
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            with self._lock:
+                self._retried += 1
+            try:
+                transport.send(message)
+            except Exception as e:
+                error = e
+                continue
+            with self._lock:
+                self._sent += 1
+            return
+        logger.error("OTP for %s not delivered by %s: %s", message.phone or message.email,
+                     type(transport).__name__, error)
+        with self._lock:
+            self._failed += 1
+
+
+def get_otp_transports():
+    """Transports named by otp_transports, built from the otp_* settings."""
+    transports = []
+    for name in MembershipCardConfig.otp_transports:
+        if name == "console":
+            transports.append(ConsoleTransport())
+        elif name == "file":
+            transports.append(FileTransport(MembershipCardConfig.otp_file_path))
+        elif name == "email":
+            transports.append(EmailTransport(
+                MembershipCardConfig.otp_email_api_url,
+                token=MembershipCardConfig.otp_email_api_token,
+                sender=MembershipCardConfig.otp_email_sender,
+                timeout=MembershipCardConfig.otp_delivery_timeout,
+            ))
+        elif name == "sms":
+            transports.append(SMSTransport(
+                MembershipCardConfig.otp_sms_api_url,
+                token=MembershipCardConfig.otp_sms_api_token,
+                sender=MembershipCardConfig.otp_sms_sender,
+                timeout=MembershipCardConfig.otp_delivery_timeout,
+            ))
+        else:
+            raise ValueError(f"Invalid OTP transport {name!r}, expected console, file, email or sms")
+    return transports
+
+
+_otp_delivery = None
+_otp_delivery_pid = None
+_otp_delivery_lock = threading.Lock()
+
+
+def get_otp_delivery():
+    """Return the OTP delivery queue of this process, configured from MembershipCardConfig."""
+    global _otp_delivery, _otp_delivery_pid
+    with _otp_delivery_lock:
+        # A forked worker starts its own threads, the parent's did not survive the fork
+        if _otp_delivery is None or _otp_delivery_pid != os.getpid():
+            _otp_delivery = OTPDelivery(
+                get_otp_transports(),
+                workers=MembershipCardConfig.otp_delivery_workers,
+                queue_size=MembershipCardConfig.otp_delivery_queue_size,
+                batch_size=MembershipCardConfig.otp_delivery_batch_size,
+                retries=MembershipCardConfig.otp_delivery_retries,
+                backoff=MembershipCardConfig.otp_delivery_backoff,
+            )
+            _otp_delivery_pid = os.getpid()
+    return _otp_delivery
+
+
+def send_otp(otp, phone=None, email=None):
+    """Queue an OTP for delivery to the phone and email given and return right away."""
+    get_otp_delivery().submit(OTPMessage(otp, phone, email))
@@ -0,0 +1,184 @@
+# otp_store.py
+import logging
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+from django.utils.crypto import constant_time_compare
+
+from membership.apps import MembershipCardConfig
+from membership.utils.db_helper import get_db_helper
+
+logger = logging.getLogger(__name__)
+
+class OTPCheck:
+    VALID = "valid"
+    INVALID = "invalid"
+    EXPIRED = "expired"
+    TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+
+class OTPStore:
+    """
+    One-time passwords of the registrations, by phone number. An OTP lives `ttl` seconds, is used
+    up by its first successful check and is dropped after `max_attempts` checks. Registrations
+    never validated are swept `pending_ttl` seconds after their OTP expired, every
+    `sweep_interval` seconds by a background thread of each process, see start_sweeper.
+    """
+
+    def __init__(self, ttl=300, max_attempts=5, pending_ttl=86400, sweep_interval=3600):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.pending_ttl = pending_ttl
+        self.sweep_interval = sweep_interval
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+        self._sweeper_stop = threading.Event()
+
+    def issue(self, phone, otp_code):
+        """Store a new OTP for the registration of a phone, replacing the previous one."""
+        raise NotImplementedError
+
+    def check(self, phone, otp_code):
+        """Check an OTP, an OTPCheck value. A VALID OTP is used up."""
+        raise NotImplementedError
+
+    def sweep(self):
+        """Delete the registrations never validated, return how many were."""
+        db_helper = get_db_helper()
+        try:
+            return db_helper.delete_pending_users_before(int(time.time()) - self.pending_ttl)
+        finally:
+            db_helper.close()
+
+    def start_sweeper(self):
+        """Start the sweeping thread of this process, unless it runs already or sweep_interval is unset."""
+        if not self.sweep_interval:
+            return
+        with self._sweeper_lock:
+            # A forked worker starts its own thread, the parent's did not survive the fork
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_periodically, name="membership-otp-sweeper", daemon=True).start()
+
+    def stop_sweeper(self):
+        self._sweeper_stop.set()
+
+    def _sweep_periodically(self):
+        while not self._sweeper_stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Sweeping pending registrations failed")
+            finally:
+                close_old_connections()
+
+
+class CacheOTPStore(OTPStore):
+    """
+    OTPs kept in the Django cache `cache_alias`, expired by the cache itself. Checks are counted
+    with the cache's atomic increment, and of concurrent checks of the right OTP only the one
+    deleting it succeeds. The cache must be shared by the server processes.
+    """
+
+    def __init__(self, cache_alias="default", **kwargs):
+        super().__init__(**kwargs)
+        self.cache_alias = cache_alias
+
+    @staticmethod
+    def cache_key(phone):
+        return f"membership:otp:{phone}"
+
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def issue(self, phone, otp_code):
+        cache = self._cache()
+        key = self.cache_key(phone)
+        cache.set_many({key: otp_code, f"{key}:attempts": 0}, self.ttl)
+        # The registration keeps the expiry, it is not swept while its OTP is live
+        db_helper = get_db_helper()
+        try:
+            db_helper.set_otp(phone, None, int(time.time()) + self.ttl)
+        finally:
+            db_helper.close()
+
+    def check(self, phone, otp_code):
+        cache = self._cache()
+        key = self.cache_key(phone)
+        attempts_key = f"{key}:attempts"
+        cache.add(attempts_key, 0, self.ttl)
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:  # expired since added
+            return OTPCheck.EXPIRED
+        saved_otp = cache.get(key)
+        if saved_otp is None:
+            return OTPCheck.EXPIRED
+        if attempts > self.max_attempts:
+            cache.delete(key)
+            return OTPCheck.TOO_MANY_ATTEMPTS
+        if not constant_time_compare(str(saved_otp), str(otp_code)):
+            return OTPCheck.INVALID
+        if not cache.delete(key):  # used up by a concurrent check
+            return OTPCheck.EXPIRED
+        cache.delete(attempts_key)
+        return OTPCheck.VALID
+
+
+class DatabaseOTPStore(OTPStore):
+    """OTPs kept on the registrations in the side database, SQLite or the membership models."""
+
+    def issue(self, phone, otp_code):
+        db_helper = get_db_helper(durable=True)  # checked as soon as the insuree reads the message
+        try:
+            db_helper.set_otp(phone, otp_code, int(time.time()) + self.ttl)
+        finally:
+            db_helper.close()
+
+    def check(self, phone, otp_code):
+        now = int(time.time())
+        db_helper = get_db_helper()
+        try:
+            attempts = db_helper.count_otp_attempt(phone, now)
+            if attempts is None:
+                return OTPCheck.EXPIRED
+            if attempts > self.max_attempts:
+                db_helper.clear_otp(phone)
+                return OTPCheck.TOO_MANY_ATTEMPTS
+            if db_helper.consume_otp(phone, str(otp_code), now):
+                return OTPCheck.VALID
+            return OTPCheck.INVALID
+        finally:
+            db_helper.close()
+
+
+OTP_STORES = {"cache": CacheOTPStore, "database": DatabaseOTPStore}
+
+_otp_store = None
+_otp_store_lock = threading.Lock()
+
+
+def get_otp_store():
+    """Return the process wide OTP store, configured from MembershipCardConfig."""
+    global _otp_store
+    with _otp_store_lock:
+        if _otp_store is None:
+            if MembershipCardConfig.otp_store not in OTP_STORES:
+                raise ValueError(
+                    f"Invalid otp_store {MembershipCardConfig.otp_store!r}, expected one of {', '.join(OTP_STORES)}"
+                )
+            kwargs = {
+                "ttl": MembershipCardConfig.otp_ttl,
+                "max_attempts": MembershipCardConfig.otp_max_attempts,
+                "pending_ttl": MembershipCardConfig.otp_pending_ttl,
+                "sweep_interval": MembershipCardConfig.otp_sweep_interval,
+            }
+            if MembershipCardConfig.otp_store == "cache":
+                kwargs["cache_alias"] = MembershipCardConfig.otp_cache_alias
+            _otp_store = OTP_STORES[MembershipCardConfig.otp_store](**kwargs)
+    _otp_store.start_sweeper()
+    return _otp_store
@@ -0,0 +1,100 @@
+# pdf_renderer.py
+import os
+import shlex
+import signal
+import subprocess
+import time
+from copy import copy
+
+from django.conf import settings
+from wkhtmltopdf.utils import _options_to_args
+
+from membership.apps import MembershipCardConfig
+from membership.utils.render_pool import RenderTimeout
+
+
+class WkhtmltopdfRenderer:
+    """
+    Converts an HTML file to PDF with wkhtmltopdf.
+
+    Same command line as wkhtmltopdf.utils.wkhtmltopdf (WKHTMLTOPDF_CMD, WKHTMLTOPDF_ENV and
+    WKHTMLTOPDF_CMD_OPTIONS settings), but the process is killed once `timeout` expires.
+    """
+
+    def command(self, pages, cmd_options):
+        options = getattr(settings, "WKHTMLTOPDF_CMD_OPTIONS", None)
+        options = {"quiet": True} if options is None else copy(options)
+        options.update(cmd_options or {})
+        options.setdefault("encoding", "utf8")
+        cmd = getattr(settings, "WKHTMLTOPDF_CMD", os.environ.get("WKHTMLTOPDF_CMD", "wkhtmltopdf"))
+        return [*shlex.split(cmd), *_options_to_args(**options), *pages, "-"]
+
+    @staticmethod
+    def kill(process):
+        if os.name == "posix":
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+                return
+            except ProcessLookupError:
+                pass
+        process.kill()
+
+    def render(self, html_path, cmd_options, timeout=None):
+        env = getattr(settings, "WKHTMLTOPDF_ENV", None)
+        if env is not None:
+            env = dict(os.environ, **env)
+        command = self.command([html_path], cmd_options)
+        # In its own process group, so a wrapper script is killed together with wkhtmltopdf
+        with subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, start_new_session=os.name == "posix"
+        ) as process:
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except BaseException as e:
+                # Killed and reaped before returning, the HTML file is not removed under a running process
+                self.kill(process)
+                process.communicate()
+                if isinstance(e, subprocess.TimeoutExpired):
+                    raise RenderTimeout(f"wkhtmltopdf did not finish within {timeout} seconds.")
+                raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        return stdout
+
+
+class StubRenderer:
+    """
+    Stand-in for WkhtmltopdfRenderer that returns a blank one page PDF without starting a process,
+    optionally after `delay` seconds. Meant for benchmarks and tests of the card path around the renderer.
+    """
+
+    PDF = (
+        b"%PDF-1.4\n"
+        b"1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+        b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+        b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+        b"trailer<</Root 1 0 R>>\n"
+        b"%%EOF\n"
+    )
+
+    def __init__(self, delay=0):
+        self.delay = delay
+
+    def render(self, html_path, cmd_options, timeout=None):
+        if not os.path.isfile(html_path):
+            raise FileNotFoundError(html_path)
+        if self.delay:
+            if timeout is not None and self.delay > timeout:
+                time.sleep(timeout)
+                raise RenderTimeout(f"stub renderer did not finish within {timeout} seconds.")
+            time.sleep(self.delay)
+        return self.PDF
+
+
+def get_pdf_renderer():
+    """Renderer selected by card_renderer: "wkhtmltopdf" (default) or "stub"."""
+    if MembershipCardConfig.card_renderer == "stub":
+        return StubRenderer(MembershipCardConfig.card_stub_render_delay)
+    if MembershipCardConfig.card_renderer == "wkhtmltopdf":
+        return WkhtmltopdfRenderer()
+    raise ValueError(f"Unknown card renderer: {MembershipCardConfig.card_renderer}")
@@ -0,0 +1,163 @@
+# photo_thumbnails.py
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from membership.apps import MembershipCardConfig
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, cards then embed the original photos
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+def make_thumbnail(source, target, size, image_format, quality):
+    """
+    Scale a photo, a file path or its bytes, down to fit `size` pixels and save it to `target`.
+    Runs in the worker processes of PhotoThumbnails, hence a plain function.
+    """
+    import io
+
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(tuple(size), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        # Written aside and renamed, a concurrent reader never sees half a thumbnail
+        partial_target = f"{target}.{os.getpid()}.tmp"
+        image.save(partial_target, image_format, quality=quality, optimize=True)
+    os.replace(partial_target, target)
+    return target
+
+
+class PhotoThumbnails:
+    """
+    Card-sized derivatives of insuree photos, stored in `directory` and named after the photo
+    id and a hash of its content, so a replaced photo never picks up the old thumbnail.
+    Thumbnails are made on first use, or ahead of it with `prefetch`, in a process pool:
+    decoding a camera image holds the GIL far longer than a request should wait for it.
+    """
+
+    def __init__(self, directory, size=(300, 400), image_format="JPEG", quality=85, workers=2, timeout=30):
+        self.directory = directory
+        self.size = tuple(size)
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        # (path, size, mtime) -> digest, photo files are only hashed again once they change
+        self._digests = OrderedDict()
+
+    def path(self, photo):
+        """Path of the thumbnail of an InsureePhoto, made if missing. None if the photo has no content."""
+        source, digest = self._source(photo)
+        if source is None:
+            return None
+        if Image is None:
+            return source if isinstance(source, str) else self._write_original(photo, source, digest)
+        target = self._target(photo, digest)
+        if not os.path.exists(target):
+            try:
+                self._submit(source, target).result(self.timeout)
+            except Exception:
+                logger.exception("Thumbnail of photo %s could not be made, the original is used", photo.id)
+                return source if isinstance(source, str) else self._write_original(photo, source, digest)
+        return target
+
+    def prefetch(self, photo):
+        """Make the thumbnail of a photo in the background, typically right after its upload."""
+        source, digest = self._source(photo)
+        if source is None or Image is None:
+            return None
+        target = self._target(photo, digest)
+        if os.path.exists(target):
+            return None
+        return self._submit(source, target)
+
+    def _source(self, photo):
+        # Photos live either in the photos folder or base64 encoded in the database
+        file_path = photo.full_file_path()
+        if file_path and os.path.isfile(file_path):
+            return file_path, self._file_digest(file_path)
+        if photo.photo:
+            content = base64.b64decode(photo.photo)
+            return content, hashlib.sha256(content).hexdigest()[:16]
+        return None, None
+
+    def _file_digest(self, file_path):
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        with open(file_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        with self._lock:
+            self._digests[key] = digest
+            if len(self._digests) > 4096:
+                self._digests.popitem(last=False)
+        return digest
+
+    def _target(self, photo, digest):
+        width, height = self.size
+        extension = EXTENSIONS.get(self.image_format, self.image_format.lower())
+        return os.path.join(self.directory, f"{photo.id}-{digest}-{width}x{height}.{extension}")
+
+    def _write_original(self, photo, content, digest):
+        target = os.path.join(self.directory, f"{photo.id}-{digest}.orig")
+        if not os.path.exists(target):
+            os.makedirs(self.directory, exist_ok=True)
+            partial_target = f"{target}.{os.getpid()}.tmp"
+            with open(partial_target, "wb") as f:
+                f.write(content)
+            os.replace(partial_target, target)
+        return target
+
+    def _submit(self, source, target):
+        with self._lock:
+            if self._executor is None:
+                os.makedirs(self.directory, exist_ok=True)
+                # Spawned, not forked: server processes run threads that a fork would copy mid-flight
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            executor = self._executor
+        return executor.submit(make_thumbnail, source, target, self.size, self.image_format, self.quality)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_photo_thumbnails = None
+_photo_thumbnails_lock = threading.Lock()
+
+
+def get_photo_thumbnails():
+    """Return the process wide photo thumbnails, configured from MembershipCardConfig."""
+    global _photo_thumbnails
+    with _photo_thumbnails_lock:
+        if _photo_thumbnails is None:
+            _photo_thumbnails = PhotoThumbnails(
+                MembershipCardConfig.card_photo_dir,
+                size=MembershipCardConfig.card_photo_size,
+                image_format=MembershipCardConfig.card_photo_format,
+                quality=MembershipCardConfig.card_photo_quality,
+                workers=MembershipCardConfig.card_photo_workers,
+            )
+    return _photo_thumbnails
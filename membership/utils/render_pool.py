@@ -0,0 +1,193 @@
+# render_pool.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from membership.apps import MembershipCardConfig
+
+
+class RenderQueueFull(Exception):
+    """Raised when the render queue is full, the caller should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Card rendering is busy, please retry later.")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """Raised when a render job did not complete in time."""
+
+
+class _JobState:
+    """Progress of a submitted job, shared by its worker and the caller waiting for it."""
+
+    def __init__(self, cleanup=None):
+        self.started = threading.Event()
+        self.finished = False
+        self.abandoned = False
+        self._cleanup = cleanup
+
+    def clean_up(self):
+        cleanup, self._cleanup = self._cleanup, None
+        if cleanup is not None:
+            cleanup()
+
+
+class RenderExecutor:
+    """
+    Runs render jobs on a fixed number of workers with a bounded queue in front of them.
+
+    Each worker drives one renderer process at a time, so `max_workers` caps the number
+    of concurrent wkhtmltopdf processes. Jobs beyond `max_workers + max_queue` are
+    rejected at once with RenderQueueFull instead of piling up in the request workers.
+    """
+
+    wait_samples = 1000
+    kill_grace = 5  # seconds a job past its budget gets to stop its renderer and report
+
+    def __init__(self, max_workers, max_queue, queue_timeout=None, retry_after=5):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="membership-render")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._waits = deque(maxlen=self.wait_samples)
+
+    def submit(self, job, cleanup=None):
+        """
+        Queue `job` (a callable without arguments) and return its future. `cleanup` is called
+        once the job is over: finished, failed, cancelled before it started, or rejected.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            if cleanup is not None:
+                cleanup()
+            raise RenderQueueFull(self.retry_after)
+        submitted_at = time.monotonic()
+        state = _JobState(cleanup)
+        with self._lock:
+            self._queued += 1
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._waits.append(time.monotonic() - submitted_at)
+            state.started.set()
+            outcome = "completed"
+            try:
+                return job()
+            except RenderTimeout:
+                outcome = "timed_out"
+                raise
+            except Exception:
+                outcome = "failed"
+                raise
+            finally:
+                with self._lock:
+                    state.finished = True
+                    # A job its caller gave up on counts as timed out, once, whatever its outcome
+                    if outcome == "timed_out" or state.abandoned:
+                        self._timed_out += 1
+                    elif outcome == "failed":
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                    self._running -= 1
+                self._slots.release()
+                state.clean_up()
+
+        try:
+            future = self._executor.submit(run)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            state.clean_up()
+            raise
+        future.job_state = state
+        future.add_done_callback(self._release_cancelled)
+        return future
+
+    def _release_cancelled(self, future):
+        # run() never started for a cancelled job, give its slot back
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            future.job_state.clean_up()
+
+    def run(self, job, timeout=None, cleanup=None):
+        """
+        Run `job` on the pool and wait for its result. The time spent waiting for a worker is
+        bounded by `queue_timeout`, a job that did not start by then is dropped. `timeout` is the
+        job's own budget: the job is expected to stop itself then, the caller waits
+        `kill_grace` seconds longer for it. Without `timeout` the caller waits until it completes.
+        """
+        future = self.submit(job, cleanup)
+        state = future.job_state
+        if not state.started.wait(self.queue_timeout) and future.cancel():
+            with self._lock:
+                self._timed_out += 1
+            raise RenderTimeout("Card rendering timed out waiting for a worker.")
+        try:
+            return future.result(timeout=None if timeout is None else timeout + self.kill_grace)
+        except FutureTimeoutError:
+            with self._lock:
+                if not state.finished:
+                    state.abandoned = True
+            if state.abandoned:
+                raise RenderTimeout("Card rendering timed out.")
+            return future.result()
+
+    def metrics(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "wait_p50": percentile(waits, 0.5),
+                "wait_p95": percentile(waits, 0.95),
+                "wait_max": waits[-1] if waits else None,
+            }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """Return the process wide render executor, created on first use from the module configuration."""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = RenderExecutor(
+                max_workers=MembershipCardConfig.card_render_workers,
+                max_queue=MembershipCardConfig.card_render_queue_size,
+                queue_timeout=MembershipCardConfig.card_render_queue_timeout,
+                retry_after=MembershipCardConfig.card_render_retry_after,
+            )
+    return _render_executor
@@ -0,0 +1,97 @@
+# single_flight.py
+import threading
+import time
+
+from membership.apps import MembershipCardConfig
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function once per key at a time: callers arriving while it runs wait for it
+    and share its result, or its exception, instead of running it again.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def metrics(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "shared": self._shared}
+
+
+_card_flights = SingleFlight()
+
+
+def get_card_flights():
+    return _card_flights
+
+
+def render_once(fingerprint, render, card_cache=None):
+    """
+    Render a card at most once at a time: within the process through SingleFlight, and across
+    processes through the render lock of the card cache, the other processes picking the card
+    up from the cache once rendered. Returns the PDF content, stored in the card cache.
+    """
+    if card_cache is None:
+        return _card_flights.do(fingerprint, render)
+    return _card_flights.do(fingerprint, lambda: _render_locked(fingerprint, render, card_cache))
+
+
+def _render_locked(fingerprint, render, card_cache):
+    lock_timeout = MembershipCardConfig.card_lock_timeout or (
+        MembershipCardConfig.card_render_timeout + MembershipCardConfig.card_render_queue_timeout
+    )
+    deadline = time.monotonic() + lock_timeout
+    locked = card_cache.acquire_lock(fingerprint, lock_timeout)
+    while not locked:
+        # Another process renders this card, wait for it to land in the cache
+        pdf_content = card_cache.get(fingerprint)
+        if pdf_content is not None:
+            return pdf_content
+        if time.monotonic() > deadline:
+            break  # the lock holder died or is stuck, render without the lock
+        time.sleep(MembershipCardConfig.card_lock_poll_interval)
+        locked = card_cache.acquire_lock(fingerprint, lock_timeout)
+    try:
+        # The previous lock holder may have finished between our cache miss and the lock
+        pdf_content = card_cache.get(fingerprint) if locked else None
+        if pdf_content is None:
+            pdf_content = render()
+            card_cache.set(fingerprint, pdf_content)
+        return pdf_content
+    finally:
+        if locked:
+            card_cache.release_lock(fingerprint)